@@ -0,0 +1,258 @@
+import os
+import json
+import hashlib
+import tempfile
+import urllib.error
+import urllib.request
+
+__version__ = '0.3.0'
+
+
+def compiler_version():
+    """Returns a string identifying this compiler build: the version number
+    and a digest of the compiler's modules.
+
+    Returns:
+        str: The compiler version
+    """
+
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(here)):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(here, name), 'rb') as f:
+            digest.update(f.read())
+    return '{}+{}'.format(__version__, digest.hexdigest()[:12])
+
+
+def make_key(source, options):
+    """Computes the cache key of a Jack class.
+
+    Args:
+        source (str): Jack source code of the class
+        options (dict): Options the output depends on (JSON serializable)
+
+    Returns:
+        str: Hex digest combining the source, compiler version and options
+    """
+
+    digest = hashlib.sha256()
+    digest.update(compiler_version().encode())
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    digest.update(source.encode())
+    return digest.hexdigest()
+
+
+class LocalCache:
+    """Cache entries stored as files in a directory, evicting the least
+    recently used ones once the directory grows past max_size bytes.
+
+    Entries live at <directory>/<key[:2]>/<key>.json, so a static file
+    server pointed at the directory can serve as an HTTPCache.
+    """
+
+    def __init__(self, directory, max_size=None):
+        """Creates a new LocalCache.
+
+        Args:
+            directory (str): Directory holding the entries
+            max_size (int, optional): Size bound in bytes. Defaults to None
+             (unbounded).
+        """
+
+        self.directory = directory
+        self.max_size = max_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def _scan(self):
+        """Returns the size and modification time of every entry.
+
+        Other processes sharing the directory may remove entries at any
+        time, so the directory is scanned afresh on each call and entries
+        gone by the time they are looked at are skipped.
+
+        Returns:
+            dict: Path -> (size, mtime)
+        """
+
+        entries = {}
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries[path] = (stat.st_size, stat.st_mtime)
+        return entries
+
+    def get(self, key):
+        """Looks up an entry, marking it as recently used.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            dict: The artifacts, or None on a miss
+        """
+
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                artifacts = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return artifacts
+
+    def put(self, key, artifacts):
+        """Stores an entry. A failed write (read-only or full directory,
+        ...) is ignored and leaves no temporary file behind.
+
+        The cache may grow past max_size until evict is called, which the
+        compiler does once per run.
+
+        Args:
+            key (str): Cache key
+            artifacts (dict): Artifact name -> text
+        """
+
+        path = self._path(key)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(artifacts, f)
+            os.replace(tmp, path)
+        except (OSError, ValueError, TypeError):
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in
+        max_size.
+
+        Returns:
+            int: Number of entries removed
+        """
+
+        if self.max_size is None:
+            return 0
+        entries = self._scan()
+        total = sum(size for size, _ in entries.values())
+        if total <= self.max_size:
+            return 0
+
+        removed = 0
+        for path in sorted(entries, key=lambda x: entries[x][1]):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass  # already evicted by another process
+            total -= entries[path][0]
+        return removed
+
+
+class HTTPCache:
+    """Cache entries fetched with GET and stored with PUT from
+    <url>/<key[:2]>/<key>.json.
+
+    Network errors count as misses, so an unreachable or read-only server
+    never breaks the build.
+    """
+
+    def __init__(self, url, timeout=5):
+        """Creates a new HTTPCache.
+
+        Args:
+            url (str): Base URL of the cache
+            timeout (int, optional): Request timeout in seconds
+        """
+
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _url(self, key):
+        return '{}/{}/{}.json'.format(self.url, key[:2], key)
+
+    def get(self, key):
+        try:
+            with urllib.request.urlopen(self._url(key),
+                                        timeout=self.timeout) as response:
+                return json.loads(response.read().decode())
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, artifacts):
+        request = urllib.request.Request(
+            self._url(key), data=json.dumps(artifacts).encode(),
+            method='PUT', headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+        except OSError:
+            pass
+
+
+class CompilationCache:
+    """Looks compiled classes up in a list of backends, fastest first.
+    """
+
+    def __init__(self, backends):
+        """Creates a new CompilationCache.
+
+        Args:
+            backends (list): LocalCache/HTTPCache objects, in lookup order
+        """
+
+        self.backends = backends
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Looks up an entry. A hit in a slower backend is copied to the
+        faster ones.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            dict: The artifacts, or None on a miss
+        """
+
+        for i, backend in enumerate(self.backends):
+            artifacts = backend.get(key)
+            if artifacts is not None:
+                for faster in self.backends[:i]:
+                    faster.put(key, artifacts)
+                self.hits += 1
+                return artifacts
+        self.misses += 1
+        return None
+
+    def put(self, key, artifacts):
+        for backend in self.backends:
+            backend.put(key, artifacts)
+
+    def evict(self):
+        """Brings the local backends back within their size bound.
+
+        Returns:
+            int: Number of entries removed
+        """
+
+        return sum(backend.evict() for backend in self.backends
+                   if isinstance(backend, LocalCache))
+
+    def summary(self):
+        return 'cache: {} hits, {} misses'.format(self.hits, self.misses)
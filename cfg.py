@@ -0,0 +1,365 @@
+COMPARISONS = ('eq', 'lt', 'gt')
+
+
+def split_functions(commands):
+    """Splits the VM commands of a class into its functions.
+
+    Args:
+        commands (list): VM commands of a whole class
+
+    Returns:
+        list: A list of lists (VM commands), each starting with "function"
+    """
+
+    functions = []
+    for command in commands:
+        if command.startswith('function') or not functions:
+            functions.append([])
+        functions[-1].append(command)
+    return functions
+
+
+def invert_branches(commands):
+    """Rewrites "if-goto T; goto F; label T" into "not; if-goto F; label T"
+    when the condition is a comparison, so the true branch falls through.
+
+    The "not" of a comparison cancels against a preceding "not"
+    (e.g. while conditions). Only comparisons are rewritten, as "not" is
+    not a logical negation for other truthy values.
+
+    Args:
+        commands (list): VM commands of a single function
+
+    Returns:
+        list: The rewritten VM commands
+    """
+
+    out = []
+    i = 0
+    while i < len(commands):
+        window = commands[i:i + 3]
+        if (len(window) == 3 and window[0].startswith('if-goto')
+                and window[1].startswith('goto')
+                and window[2] == 'label ' + window[0].split()[1]):
+            if out and out[-1] in COMPARISONS:
+                out.append('not')
+            elif len(out) > 1 and out[-2] in COMPARISONS and out[-1] == 'not':
+                out.pop()
+            else:
+                out.append(window[0])
+                i += 1
+                continue
+            out.append('if-goto ' + window[1].split()[1])
+            out.append(window[2])
+            i += 3
+        else:
+            out.append(commands[i])
+            i += 1
+    return out
+
+
+def rotate_loops(commands):
+    """Moves the exit test of loops shaped like
+
+        label H; <cond>; not; if-goto E; <body>; goto H; label E
+
+    to the bottom, so each iteration takes one branch instead of two:
+
+        goto H; label H_BODY; <body>; label H; <cond>; if-goto H_BODY;
+        label E
+
+    Only conditions ending with a comparison are rotated (see
+    invert_branches).
+
+    Args:
+        commands (list): VM commands of a single function
+
+    Returns:
+        list: The rewritten VM commands
+    """
+
+    commands = list(commands)
+    i = 0
+    while i < len(commands):
+        if not commands[i].startswith('label'):
+            i += 1
+            continue
+        head = commands[i].split()[1]
+        j = i + 1
+        while j < len(commands) and not commands[j].startswith(
+                ('label', 'goto', 'if-goto', 'return')):
+            j += 1
+        if (j == len(commands) or not commands[j].startswith('if-goto')
+                or commands[j - 2] not in COMPARISONS
+                or commands[j - 1] != 'not'):
+            i += 1
+            continue
+        end = commands[j].split()[1]
+        try:
+            k = commands.index('label ' + end, j)
+        except ValueError:
+            i += 1
+            continue
+        if commands[k - 1] != 'goto ' + head:
+            i += 1
+            continue
+
+        body_label = head + '_BODY'
+        cond = commands[i + 1:j - 1]
+        commands[i:k + 1] = (
+            ['goto ' + head, 'label ' + body_label] + commands[j + 1:k - 1]
+            + ['label ' + head] + cond + ['if-goto ' + body_label]
+            + ['label ' + end])
+        i += 1
+    return commands
+
+
+class BasicBlock:
+    """A straight-line run of VM commands.
+    """
+
+    def __init__(self, index):
+        """Creates an empty block.
+
+        Args:
+            index (int): Position of the block in the original code
+        """
+
+        self.index = index
+        self.labels = []
+        self.body = []
+        self.jump = None
+
+    @property
+    def target(self):
+        """Returns the label jumped to, if the block ends with a jump.
+        """
+
+        if self.jump is not None and self.jump != 'return':
+            return self.jump.split()[1]
+
+    @property
+    def falls_through(self):
+        """Can control fall off the end of the block?
+        """
+
+        return self.jump is None or self.jump.startswith('if-goto')
+
+
+class FlowGraph:
+    """Control-flow graph of a single VM function.
+    """
+
+    def __init__(self, commands):
+        """Splits the commands of a function into basic blocks.
+
+        Args:
+            commands (list): VM commands, starting with "function"
+        """
+
+        self.header = commands[0]
+        self.blocks = [BasicBlock(0)]
+
+        for command in commands[1:]:
+            block = self.blocks[-1]
+            if command.startswith('label'):
+                if block.body or block.jump is not None:
+                    block = BasicBlock(len(self.blocks))
+                    self.blocks.append(block)
+                block.labels.append(command.split()[1])
+            else:
+                if block.jump is not None:
+                    block = BasicBlock(len(self.blocks))
+                    self.blocks.append(block)
+                if command.startswith(('goto', 'if-goto', 'return')):
+                    block.jump = command
+                else:
+                    block.body.append(command)
+
+        self.label_map = {label: block for block in self.blocks
+                          for label in block.labels}
+
+    def successors(self, block):
+        """Returns the blocks control can pass to from the given block.
+        """
+
+        ret = []
+        if block.target is not None:
+            ret.append(self.label_map[block.target])
+        if block.falls_through and block.index + 1 < len(self.blocks):
+            ret.append(self.blocks[block.index + 1])
+        return ret
+
+    def thread_jumps(self):
+        """Retargets jumps to blocks that only contain a "goto".
+
+        Returns:
+            int: Number of jumps retargeted
+        """
+
+        threaded = 0
+        for block in self.blocks:
+            if block.target is None:
+                continue
+            label = block.target
+            seen = set()
+            while label not in seen:
+                seen.add(label)
+                dest = self.label_map[label]
+                if dest.body or dest.jump is None or \
+                   not dest.jump.startswith('goto'):
+                    break
+                label = dest.target
+            if label != block.target:
+                block.jump = '{} {}'.format(block.jump.split()[0], label)
+                threaded += 1
+        return threaded
+
+    def reachable(self):
+        """Returns the set of block indices reachable from the entry.
+        """
+
+        seen = {0}
+        work = [self.blocks[0]]
+        while work:
+            for succ in self.successors(work.pop()):
+                if succ.index not in seen:
+                    seen.add(succ.index)
+                    work.append(succ)
+        return seen
+
+    def layout(self):
+        """Orders the reachable blocks so that as many unconditional jumps
+        as possible become fall-throughs.
+
+        Blocks that fall through stay glued to their successor; a block
+        ending with "goto" is glued to its target when nothing else falls
+        into it.
+
+        Returns:
+            list: The blocks in their new order
+        """
+
+        live = self.reachable()
+        blocks = [b for b in self.blocks if b.index in live]
+        nxt = {}
+        prev = {}
+
+        for block in blocks:
+            if block.falls_through and block.index + 1 < len(self.blocks):
+                nxt[block.index] = block.index + 1
+                prev[block.index + 1] = block.index
+
+        def head(index):
+            while index in prev:
+                index = prev[index]
+            return index
+
+        for block in blocks:
+            if block.jump is None or not block.jump.startswith('goto'):
+                continue
+            dest = self.label_map[block.target].index
+            if (block.index not in nxt and dest not in prev and dest != 0
+                    and head(block.index) != dest):
+                nxt[block.index] = dest
+                prev[dest] = block.index
+
+        order = []
+        for block in blocks:
+            if block.index in prev:
+                continue
+            index = block.index
+            while index is not None:
+                order.append(self.blocks[index])
+                index = nxt.get(index)
+        return order
+
+    def to_commands(self, order):
+        """Emits the blocks in the given order, dropping jumps to the next
+        block and labels nobody jumps to.
+
+        Args:
+            order (list): The blocks to emit
+
+        Returns:
+            list: VM commands of the function
+        """
+
+        jumps = []
+        for i, block in enumerate(order):
+            following = order[i + 1] if i + 1 < len(order) else None
+            jump = block.jump
+            if block.target is not None and following is not None and \
+               block.target in following.labels:
+                jump = 'pop temp 0' if jump.startswith('if-goto') else None
+            jumps.append(jump)
+
+        used = {jump.split()[1] for jump in jumps
+                if jump is not None and jump.startswith(('goto', 'if-goto'))}
+
+        commands = [self.header]
+        for block, jump in zip(order, jumps):
+            commands.extend('label ' + label for label in block.labels
+                            if label in used)
+            commands.extend(block.body)
+            if jump is not None:
+                commands.append(jump)
+        return commands
+
+
+def count_branches(commands):
+    """Counts the goto and if-goto commands.
+
+    Args:
+        commands (list): VM commands
+
+    Returns:
+        int: Number of branch commands
+    """
+
+    return sum(1 for x in commands if x.startswith(('goto', 'if-goto')))
+
+
+def optimize_function(commands):
+    """Runs the control-flow passes on a single function until nothing
+    changes.
+
+    Args:
+        commands (list): VM commands, starting with "function"
+
+    Returns:
+        list: The optimized VM commands
+    """
+
+    while True:
+        graph = FlowGraph(rotate_loops(invert_branches(commands)))
+        graph.thread_jumps()
+        new_commands = graph.to_commands(graph.layout())
+        if new_commands == commands:
+            return commands
+        commands = new_commands
+
+
+def optimize(commands, stats=None):
+    """Runs the control-flow passes on every function of a class.
+
+    Args:
+        commands (list): VM commands of a class
+        stats (dict, optional): Filled with (before, after) static branch
+            counts per function.
+
+    Returns:
+        list: The optimized VM commands
+    """
+
+    ret = []
+    for function in split_functions(commands):
+        if not function[0].startswith('function'):
+            ret.extend(function)
+            continue
+        optimized = optimize_function(function)
+        if stats is not None:
+            stats[function[0].split()[1]] = (count_branches(function),
+                                             count_branches(optimized))
+        ret.extend(optimized)
+    return ret
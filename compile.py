@@ -1,7 +1,19 @@
 import os
 import sys
+import inspect
 import argparse
+import importlib.util
+import cfg
+import icf
+import liveness
+import loops
+import pythonBackend
+import schedule
+from cache import CompilationCache, HTTPCache, LocalCache, make_key
 from engine import CompilationEngine
+from intrinsics import INTRINSICS
+from romSize import ROM_SIZE, SizeReport, load_costs
+from stackAnalysis import STACK_SIZE, StackAnalysis
 from tokenizer import Tokenizer
 
 
@@ -27,8 +39,8 @@ def get_names(path):
             sys.exit(1)
        
     elif os.path.isdir(path):
-        paths = [x for x in os.listdir(path) 
-                 if os.path.splitext(x)[1] == '.jack']
+        paths = sorted(x for x in os.listdir(path)
+                       if os.path.splitext(x)[1] == '.jack')
         names = [os.path.splitext(x)[0] for x in paths]
         paths = [os.path.join(path, x) for x in paths]
         out_names = [os.path.join(path, x + '.vm') for x in names]
@@ -38,19 +50,264 @@ def get_names(path):
     return paths, out_names
 
 
+# Options that don't change the generated code, left out of cache keys.
+NON_OUTPUT_OPTIONS = ('inp_path', 'report', 'cache_dir', 'cache_url',
+                      'cache_max_size', 'stack_report', 'stack_budget',
+                      'stack_fail', 'stack_external', 'size_report',
+                      'rom_budget', 'rom_costs')
+
+
+def compile_source(source, args):
+    """Compiles the source of a single Jack class.
+    
+    Args:
+        source (str): Jack source code
+        args (argparse.Namespace): Command line options
+    
+    Returns:
+        dict: Artifacts of the class: "vm" holds the VM code, "report" the
+         lines of the optimization report and, with the Python backend,
+         "py" the Python module.
+    """
+
+    tk = Tokenizer(source.splitlines(True))
+    engine = CompilationEngine(
+        tk, intrinsics=None if args.no_intrinsics else INTRINSICS)
+    commands = engine.compile_class()
+    report = []
+
+    if not args.no_schedule:
+        commands = schedule.optimize(commands, report)
+    if not args.no_loops:
+        commands = loops.optimize(commands, report)
+    if not args.no_cfg:
+        stats = {}
+        commands = cfg.optimize(commands, stats)
+        for name, (before, after) in stats.items():
+            if before != after:
+                report.append('{}: {} -> {} branches'
+                              .format(name, before, after))
+    if not args.no_coalesce:
+        commands = liveness.coalesce(commands, engine.local_names, report)
+    artifacts = {'vm': '\n'.join(commands), 'report': '\n'.join(report)}
+    if args.backend == 'python':
+        artifacts['py'] = pythonBackend.translate(commands,
+                                                  engine.class_name)
+    return artifacts
+
+
+def compile_file(path, args, cache=None):
+    """Compiles a single Jack file, going through the cache if there is one.
+    
+    Args:
+        path (str): Path of the Jack file
+        args (argparse.Namespace): Command line options
+        cache (CompilationCache, optional): Cache of compiled classes
+    
+    Returns:
+        dict: Artifacts of the class (see compile_source)
+    """
+
+    with open(path, 'r') as f:
+        source = f.read()
+    if cache is None:
+        return compile_source(source, args)
+
+    options = {k: v for k, v in vars(args).items()
+               if k not in NON_OUTPUT_OPTIONS}
+    if not args.no_intrinsics:
+        options['intrinsics'] = {
+            '{}/{}'.format(*key): inspect.getsource(func)
+            for key, func in sorted(INTRINSICS.items())}
+    key = make_key(source, options)
+    artifacts = cache.get(key)
+    if artifacts is None:
+        artifacts = compile_source(source, args)
+        cache.put(key, artifacts)
+    return artifacts
+
+
+def load_intrinsics(paths):
+    """Imports modules that register extra intrinsics.
+    
+    Args:
+        paths (list): Paths of Python files calling intrinsics.register
+    """
+
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(name, path)
+        if spec is None:
+            print('{} is not a Python file.'.format(path))
+            sys.exit(1)
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+
+
+def make_cache(args):
+    """Creates the compilation cache asked for on the command line.
+    
+    Args:
+        args (argparse.Namespace): Command line options
+    
+    Returns:
+        CompilationCache: The cache, or None if caching is off
+    """
+
+    backends = []
+    if args.cache_dir:
+        backends.append(LocalCache(args.cache_dir, args.cache_max_size))
+    if args.cache_url:
+        backends.append(HTTPCache(args.cache_url))
+    if backends:
+        return CompilationCache(backends)
+
+
+def check_stack(commands, args):
+    """Reports the worst-case stack usage of the program and checks it
+    against the stack budget.
+    
+    Args:
+        commands (list): VM commands of every class of the program
+        args (argparse.Namespace): Command line options
+    
+    Returns:
+        bool: False if the budget is exceeded and that is an error
+    """
+
+    if not args.stack_report and args.stack_budget is None:
+        return True
+    analysis = StackAnalysis(commands, args.stack_external)
+    if args.stack_report:
+        print('\n'.join(analysis.report()))
+    if args.stack_budget is None:
+        return True
+
+    messages = analysis.check(args.stack_budget)
+    for message in messages:
+        print('{}: {}'.format('error' if args.stack_fail else 'warning',
+                              message))
+    return not (messages and args.stack_fail)
+
+
+def check_size(commands, args):
+    """Reports the estimated ROM size of the program and checks it against
+    the ROM budget.
+    
+    Args:
+        commands (list): VM commands of every class of the program
+        args (argparse.Namespace): Command line options
+    
+    Returns:
+        bool: False if the budget is exceeded
+    """
+
+    if not args.size_report and args.rom_budget is None:
+        return True
+    size = SizeReport(commands, load_costs(args.rom_costs))
+    if args.size_report:
+        print('\n'.join(size.report()))
+    if args.rom_budget is not None and size.total > args.rom_budget:
+        print('error: the program needs about {} instructions of ROM; the '
+              'budget is {}.'.format(size.total, args.rom_budget))
+        return False
+    return True
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('inp_path', action="store")
+    parser.add_argument('--no-schedule', action='store_true',
+                        help="evaluate operands strictly left to right")
+    parser.add_argument('--no-cfg', action='store_true',
+                        help="don't run the control-flow graph passes")
+    parser.add_argument('--no-loops', action='store_true',
+                        help="don't move invariant code out of loops or "
+                             "replace indices by running pointers")
+    parser.add_argument('--no-coalesce', action='store_true',
+                        help="don't share local slots between variables "
+                             "with disjoint live ranges")
+    parser.add_argument('--no-icf', action='store_true',
+                        help="don't merge functions with identical bodies")
+    parser.add_argument('--icf-drop', action='store_true',
+                        help="merge identical functions across classes and "
+                             "remove the merged ones; the output files then "
+                             "only work together")
+    parser.add_argument('--no-intrinsics', action='store_true',
+                        help="always call OS subroutines instead of "
+                             "expanding them inline")
+    parser.add_argument('--intrinsics', action='append', default=[],
+                        metavar='FILE',
+                        help='Python file registering extra intrinsics')
+    parser.add_argument('--backend', choices=('vm', 'python'), default='vm',
+                        help='write VM code, or Python modules running on '
+                             'jackRuntime')
+    parser.add_argument('--report', action='store_true',
+                        help='print what the optimization passes did')
+    parser.add_argument('--cache-dir',
+                        help='directory of the local compilation cache')
+    parser.add_argument('--cache-max-size', type=int,
+                        help='size bound of the local cache in bytes')
+    parser.add_argument('--cache-url',
+                        help='base URL of a remote compilation cache')
+    parser.add_argument('--stack-report', action='store_true',
+                        help='print the worst-case stack usage')
+    parser.add_argument('--stack-budget', type=int,
+                        help='warn when an entry point may need more words '
+                             'of stack (the Hack stack has {})'
+                             .format(STACK_SIZE))
+    parser.add_argument('--stack-fail', action='store_true',
+                        help='fail instead of warning when the stack '
+                             'budget is exceeded')
+    parser.add_argument('--stack-external', type=int, default=0,
+                        help='words of stack charged for each OS call')
+    parser.add_argument('--size-report', action='store_true',
+                        help='print the estimated ROM size and its biggest '
+                             'contributors')
+    parser.add_argument('--rom-budget', type=int,
+                        help='fail when the estimated ROM size exceeds this '
+                             'many instructions (the Hack ROM has {})'
+                             .format(ROM_SIZE))
+    parser.add_argument('--rom-costs',
+                        help='JSON file overriding the Hack instruction '
+                             'cost of VM commands')
 
     args = parser.parse_args()
     file_paths, outnames = get_names(args.inp_path)
+    load_intrinsics(args.intrinsics)
+    cache = make_cache(args)
+    report = []
+    classes = {}
 
     for pth, out_pth in zip(file_paths, outnames):
-        with open(pth, 'r') as f:
-            tk = Tokenizer(f.readlines())
-        engine = CompilationEngine(tk, out_pth)
-        engine.compile_class()
+        artifacts = compile_file(pth, args, cache)
+        if args.backend == 'python':
+            with open(os.path.splitext(out_pth)[0] + '.py', 'w') as f:
+                f.write(artifacts['py'])
+        if artifacts['report']:
+            report.append(artifacts['report'])
+        classes[out_pth] = artifacts['vm'].split('\n')
+    if cache is not None:
+        cache.evict()
+
+    if not args.no_icf:
+        classes = icf.fold(classes, load_costs(args.rom_costs), report,
+                           closed=args.icf_drop and
+                           os.path.isdir(args.inp_path))
+    program = []
+    for out_pth, commands in classes.items():
+        if args.backend == 'vm':
+            with open(out_pth, 'w') as f:
+                f.write('\n'.join(commands))
+        program.extend(commands)
     
+    if args.report:
+        print('\n'.join(report))
+    if cache is not None:
+        print(cache.summary())
+    stack_ok = check_stack(program, args)
+    size_ok = check_size(program, args)
+    if not (stack_ok and size_ok):
+        sys.exit(1)
     print("Finished compilation...")
 
 
@@ -1,4 +1,6 @@
+from folding import fold_constant
 from generator import VMWriter
+from intrinsics import INTRINSICS
 from symbolTable import SymbolTable
 
 
@@ -6,7 +8,17 @@ class CompilationEngine:
     """Creates an AST of the input file. 
     """
     
-    def __init__(self, input_stream, output_file):
+    def __init__(self, input_stream, output_file=None, intrinsics=INTRINSICS):
+        """Creates a new CompilationEngine.
+        
+        Args:
+            input_stream (Tokenizer): Tokens of the class to compile
+            output_file (str, optional): Path the VM code is written to
+            intrinsics (dict, optional): (name, n_args) -> function emitting
+             an inline replacement for calls to that subroutine (see
+             intrinsics.register). Pass None to always emit calls.
+        """
+
         self.tokenizer = input_stream
         self.outfile = output_file
         self.class_name = None
@@ -14,6 +26,9 @@ class CompilationEngine:
         self.buffer = []
         self.if_count = 0
         self.while_count = 0
+        self.that_cache = None
+        self.local_names = {}
+        self.intrinsics = intrinsics or {}
         self.generator = VMWriter(self.out_stream)
         self.symbol_table = SymbolTable()
         self.op_table = {
@@ -30,6 +45,8 @@ class CompilationEngine:
     def compile_class(self):
         """Compiles a Jack class to VM file.
         
+        The commands are written to the output file, if one was given.
+
         Raises:
             SyntaxError: If the current token is not expected, a SyntaxError \
              is raised.
@@ -37,6 +54,24 @@ class CompilationEngine:
             list: Output stream containing the commands 
         """
         
+        tk = self.tokenizer
+        self.compile_class_header()
+        while tk.curr_token in ('constructor', 'function', 'method'):
+            self.compile_subroutine()
+
+        if tk.curr_token != '}':
+            raise SyntaxError('} expected at end.')
+        
+        if self.outfile is not None:
+            with open(self.outfile, 'w') as f:
+                    f.write('\n'.join(self.out_stream))
+        return self.out_stream
+        
+    def compile_class_header(self):
+        """Compiles "class Name {" and the class variable declarations,
+        leaving the tokenizer at the first subroutine.
+        """
+
         tk = self.tokenizer
         tk.advance()  # "class"
         self.class_name = tk.curr_token
@@ -45,15 +80,7 @@ class CompilationEngine:
 
         while tk.curr_token in ('static', 'field'):
             self.compile_class_var_dec()
-        while tk.curr_token in ('constructor', 'function', 'method'):
-            self.compile_subroutine()
 
-        if tk.curr_token != '}':
-            raise SyntaxError('} expected at end.')
-        
-        with open(self.outfile, 'w') as f:
-                f.write('\n'.join(self.out_stream))
-        
     def compile_class_var_dec(self):
         """Compiles the Jack class variable declaration(s).
         
@@ -118,6 +145,7 @@ class CompilationEngine:
             self.compile_var_dec()
         
         n_args = self.symbol_table.var_count('VAR')
+        self.local_names[func_name] = self.symbol_table.names('VAR')
         self.generator.write_function(func_name, n_args)
 
         if subroutine_type == 'constructor':
@@ -235,19 +263,31 @@ class CompilationEngine:
 
         if tk.curr_token == '[':  # array assignment
             tk.advance()  # [
+            start = len(self.out_stream)
             self.compile_expression()
+            index_code = self.out_stream[start:]
             tk.advance()  # ]
-
-            self.generator.write_push_pop('push', cat, i)
-            self.generator.write_arithmetic('ADD')
-            self.generator.write_push_pop('pop', 'TEMP', 0)
-
             tk.advance()  # =
+            rhs_start = tk.current_token_index
+
+            # Load the address into pointer 1 straight away and store with
+            # a single "pop that 0", unless the rhs moves pointer 1 itself.
+            self.load_array_pointer(cat, i, start)
+            code_start = len(self.out_stream)
             self.compile_expression()
+            if not self.clobbers_pointer(self.out_stream[code_start:]):
+                self.generator.write_push_pop('pop', 'THAT', 0)
+            else:
+                tk.current_token_index = rhs_start
+                self.truncate(start)
+                self.out_stream.extend(index_code)
+                self.push_array_address(cat, i, start)
+                self.compile_expression()
 
-            self.generator.write_push_pop('push', 'TEMP', 0)
-            self.generator.write_push_pop('pop', 'POINTER', 1)
-            self.generator.write_push_pop('pop', 'THAT', 0)
+                self.generator.write_push_pop('pop', 'TEMP', 0)
+                self.generator.write_push_pop('pop', 'POINTER', 1)
+                self.generator.write_push_pop('push', 'TEMP', 0)
+                self.generator.write_push_pop('pop', 'THAT', 0)
         else:
             tk.advance()  # =
             self.compile_expression()
@@ -444,14 +484,13 @@ class CompilationEngine:
             tk.advance()        
             if tk.curr_token == '[':
                 tk.advance()  # "["
+                start = len(self.out_stream)
                 self.compile_expression()
                 tk.advance()  # "]"
 
                 _type, cat, i = self.symbol_table.get(var_name)
                 cat = self.convert_kind[cat]
-                self.generator.write_push_pop('push', cat, i)
-                self.generator.write_arithmetic('ADD')
-                self.generator.write_push_pop('pop', 'POINTER', 1)
+                self.load_array_pointer(cat, i, start)
                 self.generator.write_push_pop('push', 'THAT', 0)
             elif tk.curr_token in ('.', '('):
                 self.compile_subroutine_call(var_name)
@@ -461,9 +500,17 @@ class CompilationEngine:
                 self.generator.write_push_pop('push', cat, i)
               
     def compile_subroutine_call(self, var_name):
+        """Compiles a Jack subroutine call. Calls to functions of other
+        classes that have an intrinsic are expanded inline.
+        
+        Args:
+            var_name (str): The name before the "." or "(" 
+        """
+
         tk = self.tokenizer
         func_name = var_name
         n_args = 0
+        intrinsic = None
 
         if tk.curr_token == '.':
             tk.advance()  # "."
@@ -478,6 +525,7 @@ class CompilationEngine:
                 n_args += 1
             else:  # it's a class
                 func_name = "{}.{}".format(var_name, sub_name)
+                intrinsic = func_name
             
         elif tk.curr_token == '(':
             sub_name = var_name
@@ -489,8 +537,94 @@ class CompilationEngine:
         n_args += self.compile_expression_list()
         tk.advance()  # ")"
 
-        self.generator.write_call(func_name, n_args)
+        expand = self.intrinsics.get((intrinsic, n_args))
+        if expand is not None:
+            expand(self.generator)
+        else:
+            self.generator.write_call(func_name, n_args)
     
+    def push_array_address(self, cat, i, start):
+        """Pushes the address of an array element, given that the code of
+        its index expression was emitted from position start onwards.
+
+        Constant index expressions are folded; a constant 0 index needs no
+        addition at all.
+
+        Args:
+            cat (str): Segment of the array variable
+            i (int): Index of the array variable in its segment
+            start (int): Position in the output stream of the index code
+        """
+
+        index = fold_constant(self.out_stream[start:])
+        if index is not None:
+            self.truncate(start)
+            if index == 0:
+                self.generator.write_push_pop('push', cat, i)
+                return
+            self.generator.write_push_pop('push', 'CONST', index)
+        self.generator.write_push_pop('push', cat, i)
+        self.generator.write_arithmetic('ADD')
+
+    def load_array_pointer(self, cat, i, start):
+        """Points pointer 1 (the "that" segment) at an array element, given
+        that the code of its index expression was emitted from position
+        start onwards.
+
+        If pointer 1 was last loaded with the same base and index and
+        nothing since could have changed either of them, the index code is
+        dropped and the pointer is reused.
+
+        Args:
+            cat (str): Segment of the array variable
+            i (int): Index of the array variable in its segment
+            start (int): Position in the output stream of the index code
+        """
+
+        index_code = self.out_stream[start:]
+        key = None
+        if all(x.startswith('push') and x.split()[1] not in ('pointer', 'that')
+               or len(x.split()) == 1 for x in index_code):
+            key = (cat, i, tuple(index_code))
+
+        if key is not None and self.that_cache is not None:
+            cached_key, pos = self.that_cache
+            if cached_key == key and all(
+                    x.startswith('push') or len(x.split()) == 1
+                    for x in self.out_stream[pos:start]):
+                self.truncate(start)
+                return
+
+        self.push_array_address(cat, i, start)
+        self.generator.write_push_pop('pop', 'POINTER', 1)
+        if key is not None:
+            self.that_cache = (key, len(self.out_stream))
+
+    def truncate(self, start):
+        """Drops everything emitted from position start onwards.
+        
+        Args:
+            start (int): Position in the output stream to cut at
+        """
+
+        del self.out_stream[start:]
+        if self.that_cache is not None and self.that_cache[1] > start:
+            self.that_cache = None
+
+    @staticmethod
+    def clobbers_pointer(code):
+        """Can the given VM code change pointer 1?
+
+        Args:
+            code (list): VM commands
+        
+        Returns:
+            bool: True if the code calls a subroutine or pops pointer 1
+        """
+
+        return any(x.startswith('call') or x == 'pop pointer 1' 
+                   for x in code)
+
     def compile_string(self):
         tk = self.tokenizer
         string = tk.curr_token[1:]
@@ -0,0 +1,32 @@
+def fold_constant(code):
+    """Evaluates VM code built only from constants and arithmetic.
+
+    Args:
+        code (list): VM commands leaving a single value on the stack
+
+    Returns:
+        int: The value if it is a constant in 0..32767, else None
+    """
+
+    unary = {'neg': lambda x: -x, 'not': lambda x: ~x}
+    binary = {
+        'add': lambda x, y: x + y, 'sub': lambda x, y: x - y,
+        'and': lambda x, y: x & y, 'or': lambda x, y: x | y
+    }
+    stack = []
+    for command in code:
+        parts = command.split()
+        if parts[:2] == ['push', 'constant']:
+            stack.append(int(parts[2]))
+        elif command in unary and stack:
+            stack.append(unary[command](stack.pop()))
+        elif command in binary and len(stack) > 1:
+            y = stack.pop()
+            stack.append(binary[command](stack.pop(), y))
+        else:
+            return None
+        stack[-1] = (stack[-1] + 32768) % 65536 - 32768
+
+    if len(stack) != 1 or stack[0] < 0:
+        return None
+    return stack[0]
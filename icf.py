@@ -0,0 +1,209 @@
+import hashlib
+from collections import deque
+from cfg import split_functions
+from romSize import command_cost, load_costs
+
+# Functions called from outside the program, which keep their name.
+ENTRY_POINTS = ('Main.main', 'Sys.init')
+
+
+def resolve(merged, name):
+    """Follows a chain of merges to the function that was kept.
+
+    Args:
+        merged (dict): Function name -> name of the function it was merged
+         into
+        name (str): Function name
+
+    Returns:
+        str: Name of the function whose body runs
+    """
+
+    while name in merged:
+        name = merged[name]
+    return name
+
+
+def canonical_hash(function, merged):
+    """Hashes a function's body with its name, its labels and its callees
+    made canonical.
+
+    Labels are numbered in order of appearance, calls go to the function
+    finally kept and calls to the function itself don't depend on its name.
+    Statics belong to a class, so bodies using them only match within it.
+
+    Args:
+        function (list): VM commands, starting with "function"
+        merged (dict): Merges done so far (see resolve)
+
+    Returns:
+        str: Hex digest; equal digests mean the functions behave the same
+    """
+
+    name = function[0].split()[1]
+    labels = {}
+    canonical = []
+    for command in function:
+        parts = command.split()
+        op = parts[0]
+        if op == 'function':
+            parts[1] = '.'
+        elif op in ('label', 'goto', 'if-goto'):
+            parts[1] = labels.setdefault(parts[1], str(len(labels)))
+        elif op == 'call':
+            callee = resolve(merged, parts[1])
+            parts[1] = '.' if callee == name else callee
+        elif parts[1:2] == ['static']:
+            parts[1] = name.split('.')[0] + '.static'
+        canonical.append(' '.join(parts))
+    return hashlib.sha256('\n'.join(canonical).encode()).hexdigest()
+
+
+def thunk(function, target):
+    """Returns a function that passes its arguments on to another one.
+
+    Args:
+        function (list): VM commands of the function replaced
+        target (str): Name of the function with the same body
+
+    Returns:
+        list: VM commands of the thunk
+    """
+
+    n_args = 1 + max([int(x.split()[2]) for x in function
+                      if x.split()[1:2] == ['argument']] + [-1])
+    return (['function {} 0'.format(function[0].split()[1])]
+            + ['push argument {}'.format(i) for i in range(n_args)]
+            + ['call {} {}'.format(target, n_args), 'return'])
+
+
+def merge(functions):
+    """Finds the functions with identical bodies and the one kept for each,
+    which is the first in the order given.
+
+    Merging can make callers identical in turn, so the callers of each
+    merged function are hashed again. Each function is rehashed at most
+    once per callee merged, so the pass is linear in the program size.
+
+    Args:
+        functions (dict): Function name -> VM commands, in program order
+
+    Returns:
+        dict: Name of each merged function -> name of the function it was
+         merged into (see resolve)
+    """
+
+    callers = {}
+    for name, function in functions.items():
+        for command in function:
+            if command.startswith('call'):
+                callers.setdefault(command.split()[1], set()).add(name)
+
+    merged = {}
+    hashes = {}  # function name -> its latest hash
+    kept = {}  # hash -> name of the function kept for it
+    work = deque(functions)
+    queued = set(functions)
+    while work:
+        name = work.popleft()
+        queued.discard(name)
+        if name in merged:
+            continue
+        if kept.get(hashes.get(name)) == name:
+            del kept[hashes[name]]
+        hashes[name] = canonical_hash(functions[name], merged)
+        target = kept.setdefault(hashes[name], name)
+        if target == name or name in ENTRY_POINTS:
+            continue
+
+        merged[name] = target
+        name_callers = callers.pop(name, set())
+        callers.setdefault(target, set()).update(name_callers)
+        for caller in name_callers:
+            if caller not in queued and caller not in merged:
+                work.append(caller)
+                queued.add(caller)
+    return merged
+
+
+def fold(classes, costs=None, report=None, closed=False):
+    """Merges functions with identical bodies and redirects calls to the
+    one kept, which is the first in program order (the order of the keys
+    of classes).
+
+    By default, functions are only merged with twins of the same class,
+    and only calls from within the class are redirected: every class keeps
+    its own functions (as thunks calling the twin kept if that is smaller),
+    so each output still only depends on its own source. With closed,
+    functions are merged across the whole program, merged functions are
+    removed and every call goes to the function kept; the outputs then have
+    to be compiled together.
+
+    Args:
+        classes (dict): Key (e.g. the output path) -> VM commands of a class
+        costs (dict, optional): Cost table for the ROM estimate (see
+         romSize.load_costs)
+        report (list, optional): Receives a line for each merge and the
+         estimated ROM saved
+        closed (bool, optional): Are the classes the whole program, always
+         compiled together? Defaults to False.
+
+    Returns:
+        dict: Key -> VM commands of the class, with the merged functions
+         removed or replaced by thunks
+    """
+
+    functions = {}
+    owner = {}  # function name -> key of its class
+    for key, commands in classes.items():
+        for function in split_functions(commands):
+            if function[0].startswith('function'):
+                functions[function[0].split()[1]] = function
+                owner[function[0].split()[1]] = key
+
+    if closed:
+        merged = merge(functions)
+    else:
+        merged = {}
+        for key in classes:
+            merged.update(merge({name: function
+                                 for name, function in functions.items()
+                                 if owner[name] == key}))
+
+    costs = costs or load_costs()
+    replaced = {}
+    for name, target in merged.items():
+        code = [] if closed else thunk(functions[name],
+                                       resolve(merged, target))
+        if sum(command_cost(x, costs) for x in code) < \
+           sum(command_cost(x, costs) for x in functions[name]):
+            replaced[name] = code
+
+    ret = {}
+    for key, commands in classes.items():
+        ret[key] = []
+        for function in split_functions(commands):
+            name = function[0].split()[1] \
+                if function[0].startswith('function') else None
+            if name in replaced:
+                ret[key].extend(replaced[name])
+                continue
+            for command in function:
+                if command.startswith('call'):
+                    _, callee, n_args = command.split()
+                    if closed or owner.get(callee) == key:
+                        command = 'call {} {}'.format(
+                            resolve(merged, callee), n_args)
+                ret[key].append(command)
+
+    if report is not None and replaced:
+        saved = 0
+        for name in sorted(replaced):
+            saved += sum(command_cost(x, costs) for x in functions[name])
+            saved -= sum(command_cost(x, costs) for x in replaced[name])
+            report.append('{} folded into {}'.format(
+                name, resolve(merged, name)))
+        report.append('{} identical functions folded, saving about {} '
+                      'instructions ({} bytes) of ROM'
+                      .format(len(replaced), saved, 2 * saved))
+    return ret
@@ -0,0 +1,257 @@
+from engine import CompilationEngine
+from tokenizer import Tokenizer
+
+SUBROUTINE_KEYWORDS = ('constructor', 'function', 'method')
+
+
+class Segment:
+    """A subroutine of the class: its source lines and its VM code.
+    """
+
+    def __init__(self, start_line, end_line):
+        """Creates a new Segment.
+
+        Args:
+            start_line (int): First source line (the one with the keyword)
+            end_line (int): Line after the last source line
+        """
+
+        self.start_line = start_line
+        self.end_line = end_line
+        self.vm = []
+        self.if_start = self.if_count = 0
+        self.while_start = self.while_count = 0
+
+
+class IncrementalCompiler:
+    """Keeps a compiled Jack class in memory and, on each edit, recompiles
+    only the subroutine the edit falls into.
+
+    Edits that touch the class header, the class variables or more than
+    one subroutine, or that add or remove a subroutine, fall back to
+    compiling the whole class.
+    """
+
+    def __init__(self, source, postprocess=None, **engine_options):
+        """Compiles a class.
+
+        Args:
+            source (str): Jack source code of the class
+            postprocess (function, optional): Run on the VM commands of each
+             subroutine (a list starting with "function"), returns the
+             commands to keep. Defaults to None.
+            engine_options: Passed on to CompilationEngine
+        """
+
+        self.lines = source.splitlines(True)
+        self.postprocess = postprocess
+        self.engine_options = engine_options
+        self.full_compiles = 0
+        self.segments = None
+        self.compile()
+
+    def scan(self, start, end, comment_on):
+        """Tokenizes source lines.
+
+        Args:
+            start (int): First line
+            end (int): Line after the last one
+            comment_on (bool): Is the first line inside a comment?
+
+        Returns:
+            tuple: A list of the tokens of each line, a list telling for each
+             line whether it starts inside a comment, and whether the line
+             after the last one does.
+        """
+
+        tokens = []
+        states = []
+        for line in self.lines[start:end]:
+            states.append(comment_on)
+            clean, comment_on = Tokenizer.clean_line(line, comment_on)
+            tokens.append(Tokenizer.handle_line(clean) if clean else [])
+        return tokens, states, comment_on
+
+    def compile(self):
+        """Compiles the whole class and splits the output by subroutine.
+        """
+
+        self.full_compiles += 1
+        self.segments = None
+        line_tokens, self.comment_on, _ = self.scan(0, len(self.lines),
+                                                    False)
+
+        starts = [i for i, tokens in enumerate(line_tokens)
+                  if tokens and tokens[0] in SUBROUTINE_KEYWORDS]
+        first_token = []
+        count = 0
+        for tokens in line_tokens:
+            first_token.append(count)
+            count += len(tokens)
+
+        tk = Tokenizer.from_tokens(
+            [x for tokens in line_tokens for x in tokens])
+        self.engine = CompilationEngine(tk, **self.engine_options)
+        self.engine.compile_class_header()
+        self.header = list(self.engine.out_stream)
+
+        segments = []
+        incremental = True
+        for n, start in enumerate(starts):
+            end = starts[n + 1] if n + 1 < len(starts) else len(self.lines)
+            segment = Segment(start, end)
+            if tk.current_token_index != first_token[start]:
+                incremental = False
+            self.compile_segment(segment)
+            segments.append(segment)
+
+        if tk.curr_token != '}':
+            raise SyntaxError('} expected at end.')
+        self.class_segments = segments
+        if incremental:
+            self.segments = segments
+        self.next_if = self.engine.if_count
+        self.next_while = self.engine.while_count
+
+    def compile_segment(self, segment):
+        """Compiles the subroutine at the engine's current token into a
+        segment, numbering its labels from the engine's counters.
+
+        Args:
+            segment (Segment): The segment to fill in
+        """
+
+        engine = self.engine
+        del engine.out_stream[:]
+        engine.that_cache = None
+        segment.if_start = engine.if_count
+        segment.while_start = engine.while_count
+        engine.compile_subroutine()
+        segment.if_count = engine.if_count - segment.if_start
+        segment.while_count = engine.while_count - segment.while_start
+
+        vm = list(engine.out_stream)
+        if self.postprocess is not None:
+            vm = self.postprocess(vm)
+        segment.vm = vm
+
+    def recompile_segment(self, segment):
+        """Re-tokenizes and recompiles a single subroutine.
+
+        Label numbers are reused if the new code needs no more of them than
+        the old one; otherwise fresh numbers past all others are taken.
+
+        Args:
+            segment (Segment): The edited segment
+
+        Returns:
+            bool: False if the segment no longer holds exactly one
+             subroutine, in which case nothing was changed.
+        """
+
+        start, end = segment.start_line, segment.end_line
+        line_tokens, states, comment_on = self.scan(start, end,
+                                                    self.comment_on[start])
+        old_comment_on = self.comment_on[end] if end < len(self.lines) \
+            else comment_on
+        tokens = [x for line in line_tokens for x in line]
+        starts = [line for line in line_tokens
+                  if line and line[0] in SUBROUTINE_KEYWORDS]
+        if (comment_on != old_comment_on or not line_tokens[0]
+                or line_tokens[0][0] not in SUBROUTINE_KEYWORDS
+                or len(starts) != 1):
+            return False
+        if segment is not self.segments[-1]:
+            tokens.append('}')  # stands in for whatever follows
+
+        old = (segment.if_start, segment.if_count,
+               segment.while_start, segment.while_count)
+        for fresh in (False, True):
+            self.engine.tokenizer = Tokenizer.from_tokens(tokens)
+            if fresh:
+                self.engine.if_count, self.engine.while_count = \
+                    self.next_if, self.next_while
+            else:
+                self.engine.if_count = segment.if_start
+                self.engine.while_count = segment.while_start
+            self.compile_segment(segment)
+            if fresh or (segment.if_count <= old[1]
+                         and segment.while_count <= old[3]):
+                break
+        self.next_if = max(self.next_if,
+                           segment.if_start + segment.if_count)
+        self.next_while = max(self.next_while,
+                              segment.while_start + segment.while_count)
+
+        tk = self.engine.tokenizer
+        if tk.curr_token != '}' or tk.has_more_tokens():
+            raise SyntaxError('Unexpected {} after the subroutine.'
+                              .format(tk.curr_token))
+        self.comment_on[start:end] = states
+        return True
+
+    def apply_edit(self, start_line, start_col, end_line, end_col, text):
+        """Replaces a range of the source and recompiles what it affects.
+
+        Args:
+            start_line (int): Line of the start of the range (0-based)
+            start_col (int): Column of the start of the range
+            end_line (int): Line of the end of the range
+            end_col (int): Column of the end of the range (exclusive)
+            text (str): The new text of the range
+
+        Returns:
+            str: Name of the recompiled subroutine, or None if the whole
+             class was recompiled.
+        """
+
+        segment = None
+        if self.segments is not None:
+            for candidate in self.segments:
+                if candidate.start_line <= start_line and \
+                   end_line < candidate.end_line:
+                    segment = candidate
+                    break
+
+        first = self.lines[start_line] if start_line < len(self.lines) \
+            else ''
+        last = self.lines[end_line] if end_line < len(self.lines) else ''
+        new_lines = (first[:start_col] + text + last[end_col:]) \
+            .splitlines(True)
+        self.lines[start_line:end_line + 1] = new_lines
+        delta = len(new_lines) - (end_line + 1 - start_line)
+
+        if segment is None:
+            self.compile()
+            return None
+
+        index = self.segments.index(segment)
+        segment.end_line += delta
+        for later in self.segments[index + 1:]:
+            later.start_line += delta
+            later.end_line += delta
+        # the states of the new lines are filled in by recompile_segment
+        self.comment_on[start_line:end_line + 1] = \
+            self.comment_on[start_line:start_line + 1] * len(new_lines)
+
+        try:
+            done = self.recompile_segment(segment)
+        except Exception:
+            self.segments = None  # compile everything on the next edit
+            raise
+        if not done:
+            self.compile()
+            return None
+        return segment.vm[0].split()[1]
+
+    def output(self):
+        """Returns the VM code of the class.
+
+        Returns:
+            list: VM commands
+        """
+
+        ret = list(self.header)
+        for segment in self.class_segments:
+            ret.extend(segment.vm)
+        return ret
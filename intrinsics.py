@@ -0,0 +1,90 @@
+# (subroutine name, number of arguments) -> function emitting the inline
+# replacement of the call.
+INTRINSICS = {}
+
+
+def register(name, n_args):
+    """Registers an inline expansion for calls to a subroutine.
+
+    The decorated function gets the VMWriter of the engine. It must emit
+    commands that consume the n_args arguments from the stack and leave the
+    result, like the call would. Temp 0 belongs to the engine; expansions
+    may use temp 1-7 freely.
+
+    Args:
+        name (str): Full subroutine name, e.g. "Memory.peek"
+        n_args (int): Number of arguments of the call
+
+    Returns:
+        function: The decorator
+    """
+
+    def decorator(func):
+        INTRINSICS[(name, n_args)] = func
+        return func
+    return decorator
+
+
+@register('Memory.peek', 1)
+def memory_peek(writer):
+    writer.write_push_pop('pop', 'POINTER', 1)
+    writer.write_push_pop('push', 'THAT', 0)
+
+
+@register('Memory.poke', 2)
+def memory_poke(writer):
+    writer.write_push_pop('pop', 'TEMP', 1)
+    writer.write_push_pop('pop', 'POINTER', 1)
+    writer.write_push_pop('push', 'TEMP', 1)
+    writer.write_push_pop('pop', 'THAT', 0)
+    writer.write_push_pop('push', 'CONST', 0)
+
+
+@register('Math.abs', 1)
+def math_abs(writer):
+    # x & ~s | -x & s, where s = (x < 0) is 0 or -1
+    writer.write_push_pop('pop', 'TEMP', 1)
+    writer.write_push_pop('push', 'TEMP', 1)
+    writer.write_push_pop('push', 'CONST', 0)
+    writer.write_arithmetic('LT')
+    writer.write_push_pop('pop', 'TEMP', 2)
+    writer.write_push_pop('push', 'TEMP', 1)
+    writer.write_push_pop('push', 'TEMP', 2)
+    writer.write_arithmetic('NOT')
+    writer.write_arithmetic('AND')
+    writer.write_push_pop('push', 'TEMP', 1)
+    writer.write_arithmetic('NEG')
+    writer.write_push_pop('push', 'TEMP', 2)
+    writer.write_arithmetic('AND')
+    writer.write_arithmetic('OR')
+
+
+@register('Math.min', 2)
+def math_min(writer):
+    min_max(writer, 'LT')
+
+
+@register('Math.max', 2)
+def math_max(writer):
+    min_max(writer, 'GT')
+
+
+def min_max(writer, comparison):
+    """Emits (a & s) | (b & ~s) for the arguments a, b on the stack, where
+    s = (a comparison b).
+    """
+
+    writer.write_push_pop('pop', 'TEMP', 2)
+    writer.write_push_pop('pop', 'TEMP', 1)
+    writer.write_push_pop('push', 'TEMP', 1)
+    writer.write_push_pop('push', 'TEMP', 2)
+    writer.write_arithmetic(comparison)
+    writer.write_push_pop('pop', 'TEMP', 3)
+    writer.write_push_pop('push', 'TEMP', 1)
+    writer.write_push_pop('push', 'TEMP', 3)
+    writer.write_arithmetic('AND')
+    writer.write_push_pop('push', 'TEMP', 2)
+    writer.write_push_pop('push', 'TEMP', 3)
+    writer.write_arithmetic('NOT')
+    writer.write_arithmetic('AND')
+    writer.write_arithmetic('OR')
@@ -0,0 +1,623 @@
+import os
+import importlib.util
+
+# Hack memory map.
+HEAP_BASE = 2048
+SCREEN = 16384
+KBD = 24576
+RAM_SIZE = 32768
+
+# The RAM of the machine. Stack frames, temp and statics live in Python
+# variables instead, so RAM[0:2048] is unused.
+RAM = [0] * RAM_SIZE
+# Jack subroutine name -> Python function, for the OS and every class
+# loaded.
+FUNCTIONS = {}
+# Static variables of the loaded classes, one list per class.
+STATICS = []
+# Characters printed by Output, '\n' for each new line.
+OUTPUT = []
+# Key codes Keyboard.readChar will return, in order.
+KEYS = []
+# First line of the modules the Python backend generates.
+HEADER = '# Jack class translated by the Python backend'
+# Mutable OS state: the head of the heap free list, the cursor of Output
+# and the color of Screen.
+STATE = {}
+
+
+class Halt(Exception):
+    """Raised by Sys.halt to stop the program.
+    """
+
+
+class JackError(Exception):
+    """Raised by Sys.error, e.g. when the OS detects a division by zero.
+    """
+
+    def __init__(self, code):
+        """Creates a new JackError.
+
+        Args:
+            code (int): Error code of the OS (see the Jack OS API)
+        """
+
+        super().__init__('Jack OS error {}'.format(code))
+        self.code = code
+
+
+def wrap(x):
+    """Wraps an integer to a signed 16-bit value.
+
+    Args:
+        x (int): Any integer
+
+    Returns:
+        int: x modulo 2**16, between -32768 and 32767
+    """
+
+    return ((x + 32768) & 65535) - 32768
+
+
+def statics(n):
+    """Allocates the static variables of a class.
+
+    Args:
+        n (int): Number of statics
+
+    Returns:
+        list: The statics, zeroed by reset()
+    """
+
+    segment = [0] * n
+    STATICS.append(segment)
+    return segment
+
+
+def register(functions):
+    """Makes subroutines callable, replacing any of the same name.
+
+    Args:
+        functions (dict): Jack subroutine name -> Python function
+    """
+
+    FUNCTIONS.update(functions)
+
+
+def reset():
+    """Zeroes the RAM and the statics and reinitializes the OS.
+    """
+
+    RAM[:] = [0] * RAM_SIZE
+    for segment in STATICS:
+        segment[:] = [0] * len(segment)
+    del OUTPUT[:]
+    del KEYS[:]
+    STATE.update(free=HEAP_BASE, row=0, col=0, color=True)
+    RAM[HEAP_BASE] = SCREEN - HEAP_BASE - 1
+    RAM[HEAP_BASE + 1] = 0
+
+
+def load(directory):
+    """Loads every class translated by the Python backend in a directory.
+
+    Args:
+        directory (str): Directory of the generated modules
+    """
+
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith('.py'):
+            continue
+        with open(path, 'r') as f:
+            if not f.readline().startswith(HEADER):
+                continue
+        spec = importlib.util.spec_from_file_location(
+            'jack_' + os.path.splitext(name)[0], path)
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+
+
+def call(name, *args):
+    """Calls a Jack subroutine.
+
+    Args:
+        name (str): Full subroutine name, e.g. "Main.main"
+        args (int): Arguments; methods take the object first
+
+    Returns:
+        int: The value returned
+    """
+
+    return FUNCTIONS[name](*args)
+
+
+def run(directory=None):
+    """Runs a program from Sys.init until it halts.
+
+    Args:
+        directory (str, optional): Directory to load the classes from
+
+    Returns:
+        str: Everything printed by Output
+    """
+
+    if directory is not None:
+        load(directory)
+    reset()
+    try:
+        call('Sys.init')
+    except Halt:
+        pass
+    return ''.join(OUTPUT)
+
+
+def os_class(cls):
+    """Registers the static methods of a class as the OS class of the same
+    name.
+    """
+
+    register({'{}.{}'.format(cls.__name__, name): func
+              for name, func in vars(cls).items()
+              if isinstance(func, staticmethod)})
+    return cls
+
+
+def error(code):
+    """Calls Sys.error, which never returns.
+    """
+
+    return FUNCTIONS['Sys.error'](code)
+
+
+@os_class
+class Math:
+    """16-bit integer arithmetic.
+    """
+
+    @staticmethod
+    def init():
+        return 0
+
+    @staticmethod
+    def multiply(x, y):
+        return wrap(x * y)
+
+    @staticmethod
+    def divide(x, y):
+        if y == 0:
+            return error(3)
+        q = abs(x) // abs(y)
+        return wrap(q if (x < 0) == (y < 0) else -q)
+
+    @staticmethod
+    def sqrt(x):
+        if x < 0:
+            return error(4)
+        y = 0
+        while (y + 1) * (y + 1) <= x:
+            y += 1
+        return y
+
+    @staticmethod
+    def abs(x):
+        return wrap(abs(x))
+
+    @staticmethod
+    def min(x, y):
+        return min(x, y)
+
+    @staticmethod
+    def max(x, y):
+        return max(x, y)
+
+
+@os_class
+class Memory:
+    """A first-fit heap in RAM[2048:16384]. Each block is preceded by its
+    size; free blocks keep the next free block in their first word.
+    """
+
+    @staticmethod
+    def init():
+        return 0
+
+    @staticmethod
+    def peek(address):
+        return RAM[address]
+
+    @staticmethod
+    def poke(address, value):
+        RAM[address] = value
+        return 0
+
+    @staticmethod
+    def alloc(size):
+        if size <= 0:
+            return error(5)
+        for attempt in range(2):
+            prev, block = 0, STATE['free']
+            while block:
+                if RAM[block] >= size + 2:
+                    # carve the new block from the end of the free one
+                    RAM[block] -= size + 1
+                    header = block + RAM[block] + 1
+                    RAM[header] = size
+                    return header + 1
+                if RAM[block] >= size:
+                    if prev:
+                        RAM[prev + 1] = RAM[block + 1]
+                    else:
+                        STATE['free'] = RAM[block + 1]
+                    return block + 1
+                prev, block = block, RAM[block + 1]
+            defragment()
+        return error(6)
+
+    @staticmethod
+    def deAlloc(o):
+        header = o - 1
+        RAM[header + 1] = STATE['free']
+        STATE['free'] = header
+        return 0
+
+
+def defragment():
+    """Merges adjacent free blocks of the heap.
+    """
+
+    blocks = []
+    block = STATE['free']
+    while block:
+        blocks.append(block)
+        block = RAM[block + 1]
+    merged = []
+    for block in sorted(blocks):
+        if merged and merged[-1] + RAM[merged[-1]] + 1 == block:
+            RAM[merged[-1]] += RAM[block] + 1
+        else:
+            merged.append(block)
+    STATE['free'] = 0
+    for block in reversed(merged):
+        RAM[block + 1] = STATE['free']
+        STATE['free'] = block
+
+
+@os_class
+class Array:
+    """Arrays are plain heap blocks.
+    """
+
+    @staticmethod
+    def new(size):
+        if size <= 0:
+            return error(2)
+        return Memory.alloc(size)
+
+    @staticmethod
+    def dispose(this):
+        return Memory.deAlloc(this)
+
+
+@os_class
+class String:
+    """A string is a block of its capacity, its length and its characters.
+    """
+
+    @staticmethod
+    def new(max_length):
+        if max_length < 0:
+            return error(14)
+        this = Memory.alloc(max_length + 2)
+        RAM[this] = max_length
+        RAM[this + 1] = 0
+        return this
+
+    @staticmethod
+    def dispose(this):
+        return Memory.deAlloc(this)
+
+    @staticmethod
+    def length(this):
+        return RAM[this + 1]
+
+    @staticmethod
+    def charAt(this, j):
+        if not 0 <= j < RAM[this + 1]:
+            return error(15)
+        return RAM[this + 2 + j]
+
+    @staticmethod
+    def setCharAt(this, j, c):
+        if not 0 <= j < RAM[this + 1]:
+            return error(16)
+        RAM[this + 2 + j] = c
+        return 0
+
+    @staticmethod
+    def appendChar(this, c):
+        if RAM[this + 1] == RAM[this]:
+            return error(17)
+        RAM[this + 2 + RAM[this + 1]] = c
+        RAM[this + 1] += 1
+        return this
+
+    @staticmethod
+    def eraseLastChar(this):
+        if RAM[this + 1] == 0:
+            return error(18)
+        RAM[this + 1] -= 1
+        return 0
+
+    @staticmethod
+    def intValue(this):
+        value = 0
+        chars = RAM[this + 2:this + 2 + RAM[this + 1]]
+        negative = chars[:1] == [45]
+        for c in chars[1 if negative else 0:]:
+            if not 48 <= c <= 57:
+                break
+            value = wrap(value * 10 + c - 48)
+        return wrap(-value) if negative else value
+
+    @staticmethod
+    def setInt(this, number):
+        digits = [ord(c) for c in str(number)]
+        if len(digits) > RAM[this]:
+            return error(19)
+        RAM[this + 1] = len(digits)
+        RAM[this + 2:this + 2 + len(digits)] = digits
+        return 0
+
+    @staticmethod
+    def newLine():
+        return 128
+
+    @staticmethod
+    def backSpace():
+        return 129
+
+    @staticmethod
+    def doubleQuote():
+        return 34
+
+
+def string_value(s):
+    """Returns the text of a Jack String.
+
+    Args:
+        s (int): Address of the String
+
+    Returns:
+        str: Its characters
+    """
+
+    return ''.join(chr(c) for c in RAM[s + 2:s + 2 + RAM[s + 1]])
+
+
+@os_class
+class Output:
+    """Records the printed characters in OUTPUT instead of drawing them on
+    the screen, keeping track of the cursor.
+    """
+
+    @staticmethod
+    def init():
+        return 0
+
+    @staticmethod
+    def moveCursor(i, j):
+        if not (0 <= i < 23 and 0 <= j < 64):
+            return error(20)
+        STATE['row'], STATE['col'] = i, j
+        return 0
+
+    @staticmethod
+    def printChar(c):
+        if c == 128:
+            return Output.println()
+        if c == 129:
+            return Output.backSpace()
+        OUTPUT.append(chr(c))
+        STATE['col'] += 1
+        if STATE['col'] == 64:
+            Output.println()
+        return 0
+
+    @staticmethod
+    def printString(s):
+        for c in RAM[s + 2:s + 2 + RAM[s + 1]]:
+            Output.printChar(c)
+        return 0
+
+    @staticmethod
+    def printInt(i):
+        for c in str(i):
+            Output.printChar(ord(c))
+        return 0
+
+    @staticmethod
+    def println():
+        OUTPUT.append('\n')
+        STATE['row'] = (STATE['row'] + 1) % 23
+        STATE['col'] = 0
+        return 0
+
+    @staticmethod
+    def backSpace():
+        if OUTPUT and OUTPUT[-1] != '\n':
+            OUTPUT.pop()
+        if STATE['col']:
+            STATE['col'] -= 1
+        return 0
+
+
+@os_class
+class Screen:
+    """Draws into the screen memory map, RAM[16384:24576].
+    """
+
+    @staticmethod
+    def init():
+        return 0
+
+    @staticmethod
+    def clearScreen():
+        RAM[SCREEN:KBD] = [0] * (KBD - SCREEN)
+        return 0
+
+    @staticmethod
+    def setColor(b):
+        STATE['color'] = b != 0
+        return 0
+
+    @staticmethod
+    def drawPixel(x, y):
+        if not (0 <= x < 512 and 0 <= y < 256):
+            return error(7)
+        fill_row(y, x, x)
+        return 0
+
+    @staticmethod
+    def drawLine(x1, y1, x2, y2):
+        if not (0 <= x1 < 512 and 0 <= x2 < 512 and
+                0 <= y1 < 256 and 0 <= y2 < 256):
+            return error(8)
+        if y1 == y2:
+            fill_row(y1, min(x1, x2), max(x1, x2))
+            return 0
+        dx, dy = abs(x2 - x1), abs(y2 - y1)
+        sx = 1 if x2 >= x1 else -1
+        sy = 1 if y2 >= y1 else -1
+        a = b = diff = 0  # diff = a * dy - b * dx
+        while a <= dx and b <= dy:
+            fill_row(y1 + sy * b, x1 + sx * a, x1 + sx * a)
+            if diff < 0:
+                a += 1
+                diff += dy
+            else:
+                b += 1
+                diff -= dx
+        return 0
+
+    @staticmethod
+    def drawRectangle(x1, y1, x2, y2):
+        if not (0 <= x1 <= x2 < 512 and 0 <= y1 <= y2 < 256):
+            return error(9)
+        for y in range(y1, y2 + 1):
+            fill_row(y, x1, x2)
+        return 0
+
+    @staticmethod
+    def drawCircle(x, y, r):
+        if not (0 <= x < 512 and 0 <= y < 256):
+            return error(12)
+        if not 0 <= r <= 181 or not (0 <= x - r and x + r < 512 and
+                                     0 <= y - r and y + r < 256):
+            return error(13)
+        for dy in range(-r, r + 1):
+            h = Math.sqrt(r * r - dy * dy)
+            fill_row(y + dy, x - h, x + h)
+        return 0
+
+
+def fill_row(y, x1, x2):
+    """Sets pixels x1..x2 of screen row y to the current color.
+    """
+
+    base = SCREEN + y * 32
+    for word in range(x1 // 16, x2 // 16 + 1):
+        low = max(x1, word * 16) - word * 16
+        high = min(x2, word * 16 + 15) - word * 16
+        mask = ((1 << (high + 1)) - 1) ^ ((1 << low) - 1)
+        value = RAM[base + word] & 65535
+        value = value | mask if STATE['color'] else value & ~mask
+        RAM[base + word] = wrap(value)
+
+
+@os_class
+class Keyboard:
+    """Reads the key pressed from RAM[24576]; readChar takes the keys
+    typed from KEYS instead of waiting for them.
+    """
+
+    @staticmethod
+    def init():
+        return 0
+
+    @staticmethod
+    def keyPressed():
+        return RAM[KBD]
+
+    @staticmethod
+    def readChar():
+        if not KEYS:
+            raise Halt('No more keys to read.')
+        c = KEYS.pop(0)
+        if c != 128:
+            Output.printChar(c)
+        return c
+
+    @staticmethod
+    def readLine(message):
+        Output.printString(message)
+        s = String.new(80)
+        while True:
+            c = Keyboard.readChar()
+            if c == 128:
+                Output.println()
+                return s
+            if c == 129:
+                if RAM[s + 1]:
+                    String.eraseLastChar(s)
+            else:
+                String.appendChar(s, c)
+
+    @staticmethod
+    def readInt(message):
+        s = Keyboard.readLine(message)
+        value = String.intValue(s)
+        String.dispose(s)
+        return value
+
+
+def type_text(text):
+    """Queues keys for Keyboard.readChar.
+
+    Args:
+        text (str): Characters to type, '\\n' for the newline key
+    """
+
+    KEYS.extend(128 if c == '\n' else ord(c) for c in text)
+
+
+@os_class
+class Sys:
+    """Sys.halt raises Halt and Sys.error raises JackError, which stop the
+    program where the Hack computer would loop forever.
+    """
+
+    @staticmethod
+    def init():
+        for name in ('Memory', 'Math', 'Screen', 'Output', 'Keyboard'):
+            call(name + '.init')
+        call('Main.main')
+        return Sys.halt()
+
+    @staticmethod
+    def halt():
+        raise Halt()
+
+    @staticmethod
+    def error(code):
+        for c in 'ERR{}'.format(code):
+            Output.printChar(ord(c))
+        raise JackError(code)
+
+    @staticmethod
+    def wait(duration):
+        if duration < 0:
+            return error(1)
+        return 0
+
+
+reset()
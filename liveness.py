@@ -0,0 +1,162 @@
+from cfg import split_functions
+
+
+def successors(commands):
+    """Returns the indices control can pass to after each command.
+
+    Args:
+        commands (list): VM commands of a single function
+
+    Returns:
+        list: A list of lists of command indices
+    """
+
+    labels = {x.split()[1]: i for i, x in enumerate(commands)
+              if x.startswith('label')}
+    ret = []
+    for i, command in enumerate(commands):
+        succ = []
+        if command.startswith(('goto', 'if-goto')):
+            succ.append(labels[command.split()[1]])
+        if not command.startswith(('goto', 'return')) and \
+           i + 1 < len(commands):
+            succ.append(i + 1)
+        ret.append(succ)
+    return ret
+
+
+def local_access(command):
+    """Returns the local a command reads or writes.
+
+    Args:
+        command (str): A VM command
+
+    Returns:
+        tuple: ("push" or "pop", local index), or None
+    """
+
+    parts = command.split()
+    if len(parts) == 3 and parts[1] == 'local':
+        return parts[0], int(parts[2])
+
+
+def live_out(commands):
+    """Computes which locals are live after each command.
+
+    Args:
+        commands (list): VM commands of a single function
+
+    Returns:
+        list: A set of local indices for each command
+    """
+
+    succ = successors(commands)
+    access = [local_access(x) for x in commands]
+    live_in = [set() for _ in commands]
+    out = [set() for _ in commands]
+
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(commands))):
+            new_out = set().union(*(live_in[j] for j in succ[i]))
+            new_in = set(new_out)
+            if access[i] is not None:
+                op, index = access[i]
+                if op == 'pop':
+                    new_in.discard(index)
+                else:
+                    new_in.add(index)
+            if new_in != live_in[i] or new_out != out[i]:
+                live_in[i], out[i] = new_in, new_out
+                changed = True
+    return out
+
+
+def coalesce_function(commands):
+    """Gives locals with disjoint live ranges the same slot and shrinks the
+    frame accordingly. Locals that are never used get no slot.
+
+    Two locals interfere when one is written while the other is live.
+    Locals that are read before being written still see the zero the VM
+    initialized their slot with, since any write to a shared slot would
+    make them interfere.
+
+    Args:
+        commands (list): VM commands, starting with "function"
+
+    Returns:
+        tuple: The rewritten commands and a dict of old -> new slot
+    """
+
+    out = live_out(commands)
+    used = set()
+    interference = {}
+    for command, live in zip(commands, out):
+        access = local_access(command)
+        if access is None:
+            continue
+        op, index = access
+        used.add(index)
+        interference.setdefault(index, set())
+        if op == 'pop':
+            for other in live - {index}:
+                interference[index].add(other)
+                interference.setdefault(other, set()).add(index)
+
+    mapping = {}
+    for index in sorted(used):
+        taken = {mapping[x] for x in interference[index] if x in mapping}
+        slot = 0
+        while slot in taken:
+            slot += 1
+        mapping[index] = slot
+
+    _, name, _ = commands[0].split()
+    ret = ['function {} {}'.format(name, len(set(mapping.values())))]
+    for command in commands[1:]:
+        access = local_access(command)
+        if access is not None:
+            command = '{} local {}'.format(access[0], mapping[access[1]])
+        ret.append(command)
+    return ret, mapping
+
+
+def coalesce(commands, names=None, report=None):
+    """Coalesces the local slots of every function of a class.
+
+    Args:
+        commands (list): VM commands of a class
+        names (dict, optional): Function name -> list of local names, used
+         in the report.
+        report (list, optional): Receives a line for each function whose
+         frame changed.
+
+    Returns:
+        list: The rewritten VM commands
+    """
+
+    ret = []
+    for function in split_functions(commands):
+        if not function[0].startswith('function'):
+            ret.extend(function)
+            continue
+        new_function, mapping = coalesce_function(function)
+        ret.extend(new_function)
+
+        _, name, n_locals = function[0].split()
+        n_locals = int(n_locals)
+        if report is None or (
+                all(k == v for k, v in mapping.items())
+                and len(mapping) == n_locals):
+            continue
+        local_names = (names or {}).get(name, [])
+        moves = []
+        for index in range(n_locals):
+            label = local_names[index] if index < len(local_names) \
+                else 'local {}'.format(index)
+            moves.append('{}->{}'.format(label, mapping[index])
+                         if index in mapping else '{} unused'.format(label))
+        report.append('{}: {} -> {} locals ({})'.format(
+            name, n_locals, len(set(mapping.values())), ', '.join(moves)))
+    return ret
@@ -0,0 +1,440 @@
+from cfg import split_functions
+from folding import fold_constant
+from liveness import live_out
+from stackAnalysis import stack_effect
+
+ARITHMETIC = ('add', 'sub', 'and', 'or', 'eq', 'lt', 'gt', 'neg', 'not')
+
+
+def find_loops(commands):
+    """Finds the loops of a function: a "label H" followed later by the
+    only "goto H" back to it.
+
+    Args:
+        commands (list): VM commands of a single function
+
+    Returns:
+        list: (head index, back edge index) pairs, innermost loops first
+    """
+
+    labels = {x.split()[1]: i for i, x in enumerate(commands)
+              if x.startswith('label')}
+    jumps = {}
+    for i, command in enumerate(commands):
+        if command.startswith(('goto', 'if-goto')):
+            jumps.setdefault(command.split()[1], []).append(i)
+
+    loops = []
+    for label, sources in jumps.items():
+        head = labels[label]
+        if len(sources) == 1 and sources[0] > head and \
+           commands[sources[0]].startswith('goto'):
+            loops.append((head, sources[0]))
+    return sorted(loops, key=lambda x: x[1] - x[0])
+
+
+def fold_constants(commands):
+    """Replaces constant-only expressions by a single "push constant".
+
+    Args:
+        commands (list): VM commands
+
+    Returns:
+        list: The rewritten commands
+    """
+
+    ret = []
+    for command in commands:
+        ret.append(command)
+        if command not in ARITHMETIC:
+            continue
+        # the shortest constant suffix that evaluates to one value
+        for start in range(len(ret) - 2, max(len(ret) - 4, -1), -1):
+            value = fold_constant(ret[start:])
+            if value is not None:
+                ret[start:] = ['push constant {}'.format(value)]
+                break
+    return ret
+
+
+class LoopInfo:
+    """What the body of a loop writes, to tell which values stay the same
+    on every iteration.
+    """
+
+    def __init__(self, region):
+        """Collects the writes of a loop.
+
+        Args:
+            region (list): VM commands of the loop, header to back edge
+        """
+
+        self.written = set()  # ("local"|"argument", index)
+        self.has_call = False
+        self.writes_memory = False  # this, that or pointer 0
+        self.writes_static = False
+        for command in region:
+            parts = command.split()
+            if parts[0] == 'call':
+                self.has_call = True
+            elif parts[0] == 'pop':
+                if parts[1] in ('local', 'argument'):
+                    self.written.add((parts[1], int(parts[2])))
+                elif parts[1] in ('this', 'that') or \
+                     command == 'pop pointer 0':
+                    self.writes_memory = True
+                elif parts[1] == 'static':
+                    self.writes_static = True
+
+    def invariant(self, command):
+        """Does a push command push the same value on every iteration?
+
+        Calls may change any field, array element or static, so those only
+        count as invariant in loops without calls.
+
+        Args:
+            command (str): A VM command
+
+        Returns:
+            bool: True if the command is an invariant push
+        """
+
+        parts = command.split()
+        if parts[0] != 'push':
+            return False
+        segment = parts[1]
+        if segment == 'constant':
+            return True
+        elif segment in ('local', 'argument'):
+            return (segment, int(parts[2])) not in self.written
+        elif segment == 'this':
+            return not (self.has_call or self.writes_memory)
+        elif command == 'push pointer 0':
+            return not self.writes_memory
+        elif segment == 'static':
+            return not (self.has_call or self.writes_static)
+        return False
+
+
+def invariant_ranges(region, info):
+    """Finds the maximal invariant expressions of a loop worth hoisting.
+
+    Args:
+        region (list): VM commands of the loop
+        info (LoopInfo): Writes of the loop
+
+    Returns:
+        list: (start, end) index ranges into region
+    """
+
+    ranges = []
+    stack = []  # (start, end, invariant) of each value on the stack
+
+    def consume(n):
+        operands = stack[len(stack) - n:] if n else []
+        del stack[len(stack) - n:]
+        return operands
+
+    for i, command in enumerate(region):
+        op = command.split()[0]
+        if op in ('label', 'goto'):
+            stack = []
+            continue
+        popped, pushed = stack_effect(command)
+        if popped > len(stack):
+            stack = []
+            continue
+        operands = consume(popped)
+
+        if op == 'push':
+            stack.append((i, i + 1, info.invariant(command)))
+            continue
+        invariant = op in ARITHMETIC and all(x[2] for x in operands)
+        if not invariant:
+            ranges.extend((s, e) for s, e, inv in operands
+                          if inv and worth_hoisting(region[s:e]))
+        if pushed:
+            start = operands[0][0] if operands else i
+            stack.append((start, i + 1, invariant))
+    return ranges
+
+
+def worth_hoisting(code):
+    """Is an invariant expression worth a local of its own? It has to save
+    at least a binary operation per iteration, and constants are cheaper
+    to push than a local.
+
+    Args:
+        code (list): VM commands of the expression
+
+    Returns:
+        bool: True if the expression should be hoisted
+    """
+
+    return len(code) > 2 and \
+        not all(x.startswith('push constant') or x in ARITHMETIC
+                for x in code)
+
+
+def induction_pointers(region, info):
+    """Finds locals only ever changed by "let i = i + c" and the bases they
+    are added to often enough that keeping i + base in a local of its own
+    pays for updating it alongside i.
+
+    Args:
+        region (list): VM commands of the loop
+        info (LoopInfo): Writes of the loop
+
+    Returns:
+        dict: (induction local, base push command) -> list of indices of
+         the "push local i" starting each i + base in region
+    """
+
+    steps = {}
+    other = set()
+    for i, command in enumerate(region):
+        parts = command.split()
+        if parts[:2] != ['pop', 'local']:
+            continue
+        var = 'push local ' + parts[2]
+        if (i >= 3 and region[i - 3] == var
+                and region[i - 2].startswith('push constant')
+                and region[i - 1] in ('add', 'sub')):
+            steps.setdefault(var, []).append(i)
+        else:
+            other.add(var)
+
+    uses = {}
+    for i in range(len(region) - 2):
+        var, base, op = region[i:i + 3]
+        if (var in steps and var not in other and op == 'add'
+                and info.invariant(base)
+                and not base.startswith('push constant')):
+            uses.setdefault((var, base), []).append(i)
+
+    # Each update costs about as much as two i + base additions save.
+    return {key: found for key, found in uses.items()
+            if len(found) > 2 * len(steps[key[0]])}
+
+
+def eliminable_induction(region, info, var):
+    """Tells whether an induction local is only used for addressing, so
+    that it can be replaced by a pointer p = i + base altogether: i + base
+    becomes p and "let i = i + c" becomes "let p = p + c".
+
+    Locals that are also compared are kept: i < n and i + base < n + base
+    differ once either sum wraps around at 16 bits.
+
+    Args:
+        region (list): VM commands of the loop
+        info (LoopInfo): Writes of the loop
+        var (str): "push local i" for an induction local i
+
+    Returns:
+        tuple: The base push command, the indices of the i + base uses and
+         of the updates (starting at their "push local i"); or None if i
+         has other uses.
+    """
+
+    base = None
+    uses, steps = [], []
+    for j, command in enumerate(region):
+        if command == 'pop' + var[4:] and not (
+                j >= 3 and j - 3 in steps):
+            return None
+        if command != var:
+            continue
+        following = region[j + 1:j + 4]
+        if following[1:2] == ['add'] and info.invariant(following[0]) \
+           and not following[0].startswith('push constant') \
+           and base in (None, following[0]):
+            base = following[0]
+            uses.append(j)
+        elif len(following) == 3 and \
+                following[0].startswith('push constant') and \
+                following[1] in ('add', 'sub') and \
+                following[2] == 'pop' + var[4:]:
+            steps.append(j)
+        else:
+            return None
+    if base is None or not steps:
+        return None
+    return base, uses, steps
+
+
+def dead_after(commands, head, back, index):
+    """Is a local dead wherever control leaves a loop?
+
+    Args:
+        commands (list): VM commands of a function
+        head (int): Index of the loop's label
+        back (int): Index of the loop's back edge
+        index (int): Local index
+
+    Returns:
+        bool: True if no exit of the loop can read the local before it is
+         written
+    """
+
+    labels = {x.split()[1]: i for i, x in enumerate(commands)
+              if x.startswith('label')}
+    out = live_out(commands)
+    for command in commands[head:back + 1]:
+        if command.startswith(('goto', 'if-goto')):
+            target = labels[command.split()[1]]
+            if not head <= target <= back and index in out[target]:
+                return False
+    return True
+
+
+def optimize_loop(commands, head, back, n_locals, stats):
+    """Moves invariant expressions out of a loop and replaces i + base by
+    running pointers.
+
+    Args:
+        commands (list): VM commands of a function
+        head (int): Index of the loop's label
+        back (int): Index of the loop's back edge
+        n_locals (int): Number of locals used so far
+        stats (dict): Counts of "hoisted" and "pointers", updated
+
+    Returns:
+        tuple: The rewritten commands and the new number of locals
+    """
+
+    region = commands[head + 1:back + 1]
+    info = LoopInfo(region)
+    preheader = []
+
+    # induction locals only used for addressing: replaced by pointers
+    for var in sorted({x for x in region if x.startswith('push local')}):
+        found = eliminable_induction(region, info, var)
+        if found is None or not dead_after(commands, head, back,
+                                           int(var.split()[2])):
+            continue
+        base, uses, steps = found
+        pointer = 'local {}'.format(n_locals)
+        n_locals += 1
+        stats['pointers'] += 1
+        preheader += [var, base, 'add', 'pop ' + pointer]
+        replace = {j: (3, ['push ' + pointer]) for j in uses}
+        for j in steps:
+            replace[j] = (4, ['push ' + pointer, region[j + 1],
+                              region[j + 2], 'pop ' + pointer])
+        region = rewrite(region, replace, {})
+        info = LoopInfo(region)
+
+    pointers = induction_pointers(region, info)
+    replace = {}  # index -> (length, replacement)
+    after = {}  # index -> commands to insert after it
+    for (var, base), found in pointers.items():
+        pointer = 'local {}'.format(n_locals)
+        n_locals += 1
+        stats['pointers'] += 1
+        preheader += [var, base, 'add', 'pop ' + pointer]
+        for i in found:
+            replace[i] = (3, ['push ' + pointer])
+        for i, command in enumerate(region):
+            if command == 'pop ' + var.split(None, 1)[1]:
+                after.setdefault(i, []).extend(
+                    ['push ' + pointer, region[i - 2], region[i - 1],
+                     'pop ' + pointer])
+    region = rewrite(region, replace, after)
+
+    info = LoopInfo(region)
+    replace = {}
+    hoisted = {}
+    for start, end in invariant_ranges(region, info):
+        code = tuple(region[start:end])
+        if code not in hoisted:
+            hoisted[code] = 'local {}'.format(n_locals)
+            n_locals += 1
+            stats['hoisted'] += 1
+            preheader += list(code) + ['pop ' + hoisted[code]]
+        replace[start] = (end - start, ['push ' + hoisted[code]])
+    region = rewrite(region, replace, {})
+
+    return (commands[:head] + preheader + [commands[head]] + region
+            + commands[back + 1:], n_locals)
+
+
+def rewrite(region, replace, after):
+    """Applies replacements and insertions to a list of commands.
+
+    Args:
+        region (list): VM commands
+        replace (dict): index -> (number of commands, replacement list)
+        after (dict): index -> commands to insert after that command
+
+    Returns:
+        list: The rewritten commands
+    """
+
+    ret = []
+    i = 0
+    while i < len(region):
+        if i in replace:
+            length, code = replace[i]
+            ret.extend(code)
+            i += length
+            continue
+        ret.append(region[i])
+        ret.extend(after.get(i, []))
+        i += 1
+    return ret
+
+
+def optimize_function(commands, stats):
+    """Optimizes the loops of a function, innermost first.
+
+    Args:
+        commands (list): VM commands, starting with "function"
+        stats (dict): Counts of "hoisted" and "pointers", updated
+
+    Returns:
+        list: The rewritten VM commands
+    """
+
+    _, name, n_locals = commands[0].split()
+    n_locals = int(n_locals)
+    commands = fold_constants(commands)
+
+    done = set()
+    while True:
+        loops = [x for x in find_loops(commands)
+                 if commands[x[0]] not in done]
+        if not loops:
+            break
+        head, back = loops[0]
+        done.add(commands[head])
+        commands, n_locals = optimize_loop(commands, head, back, n_locals,
+                                           stats)
+
+    commands[0] = 'function {} {}'.format(name, n_locals)
+    return commands
+
+
+def optimize(commands, report=None):
+    """Optimizes the loops of every function of a class.
+
+    Args:
+        commands (list): VM commands of a class
+        report (list, optional): Receives a line for each function changed
+
+    Returns:
+        list: The rewritten VM commands
+    """
+
+    ret = []
+    for function in split_functions(commands):
+        if not function[0].startswith('function'):
+            ret.extend(function)
+            continue
+        stats = {'hoisted': 0, 'pointers': 0}
+        ret.extend(optimize_function(function, stats))
+        if report is not None and (stats['hoisted'] or stats['pointers']):
+            report.append('{}: {} invariant expressions hoisted, {} running '
+                          'pointers'.format(function[0].split()[1],
+                                            stats['hoisted'],
+                                            stats['pointers']))
+    return ret
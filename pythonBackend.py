@@ -0,0 +1,361 @@
+from cfg import split_functions
+from jackRuntime import HEADER
+from stackAnalysis import stack_effect
+
+# The VM's add, sub and neg wrap around at 16 bits.
+WRAP = '((({} + 32768) & 65535) - 32768)'
+BINARY = {'and': '({} & {})', 'or': '({} | {})'}
+COMPARISONS = {'eq': '==', 'lt': '<', 'gt': '>'}
+# What a call may change, as far as the caller can tell.
+CALL_WRITES = frozenset(('M', 'S'))
+
+
+class Value:
+    """A value on the translator's symbolic stack: a Python expression and
+    the state it reads.
+
+    The reads are local names ("l0", "a1", "t0", "this", "that"), "M" for
+    RAM and "S" for the statics. Before something a value reads is
+    written, the value is stored in a variable of its own.
+    """
+
+    def __init__(self, expr, reads=(), test=None):
+        """Creates a new Value.
+
+        Args:
+            expr (str): Python expression of the value
+            reads (iterable, optional): State the expression reads
+            test (str, optional): Python expression that is true if the value
+             is not 0, if simpler than the value itself
+        """
+
+        self.expr = expr
+        self.reads = frozenset(reads)
+        self.test = test or expr
+
+
+class FunctionTranslator:
+    """Translates a VM function into a Python function.
+
+    Locals, arguments, temp and the this/that pointers become Python
+    variables and the stack is kept symbolic, so "push local 0; push
+    constant 1; add; pop local 0" becomes a single assignment. Functions
+    with jumps dispatch on a block number; only backward jumps go around
+    the dispatch loop again.
+    """
+
+    def __init__(self, commands, class_name, n_statics):
+        """Creates a new FunctionTranslator.
+
+        Args:
+            commands (list): VM commands, starting with "function"
+            class_name (str): Class of the function, whose other functions
+             are called directly
+            n_statics (int): Number of statics of the class
+        """
+
+        _, self.name, n_locals = commands[0].split()
+        self.n_locals = int(n_locals)
+        self.class_name = class_name
+        self.n_statics = n_statics
+        self.lines = []
+        self.stack = []
+        self.n_vars = 0
+
+        self.blocks = [[]]
+        for command in commands[1:]:
+            if command.startswith('label') and self.blocks[-1]:
+                self.blocks.append([])
+            self.blocks[-1].append(command)
+            if command.startswith(('goto', 'if-goto', 'return')):
+                self.blocks.append([])
+        if not self.blocks[-1]:
+            self.blocks.pop()
+        self.labels = {block[0].split()[1]: i
+                       for i, block in enumerate(self.blocks)
+                       if block[0].startswith('label')}
+        self.depth = self.entry_depths()
+
+    def entry_depths(self):
+        """Computes the stack depth at the start of each reachable block.
+
+        Returns:
+            dict: Block index -> depth
+        """
+
+        depth = {0: 0}
+        work = [0]
+        while work:
+            index = work.pop()
+            d = depth[index]
+            for command in self.blocks[index]:
+                popped, pushed = stack_effect(command)
+                d += pushed - popped
+            last = self.blocks[index][-1].split()
+            targets = []
+            if last[0] in ('goto', 'if-goto'):
+                targets.append(self.labels[last[1]])
+            if last[0] not in ('goto', 'return') and \
+               index + 1 < len(self.blocks):
+                targets.append(index + 1)
+            for target in targets:
+                if target not in depth:
+                    depth[target] = d
+                    work.append(target)
+        return depth
+
+    def emit(self, line, indent):
+        self.lines.append('    ' * indent + line)
+
+    def new_var(self):
+        self.n_vars += 1
+        return 'v{}'.format(self.n_vars - 1)
+
+    def flush(self, writes, indent):
+        """Stores the values on the stack that read something about to be
+        written in variables.
+
+        Args:
+            writes (frozenset): State about to be written
+            indent (int): Indentation level of the code
+        """
+
+        for i, value in enumerate(self.stack):
+            if value.reads & writes:
+                var = self.new_var()
+                self.emit('{} = {}'.format(var, value.expr), indent)
+                self.stack[i] = Value(var)
+
+    def pop(self, n=1):
+        values = self.stack[len(self.stack) - n:]
+        del self.stack[len(self.stack) - n:]
+        return values
+
+    def push(self, segment, index):
+        if segment == 'constant':
+            return Value(str(index))
+        elif segment in ('local', 'argument', 'temp'):
+            var = '{}{}'.format(segment[0], index)
+            return Value(var, [var])
+        elif segment == 'pointer':
+            var = ('this', 'that')[index]
+            return Value(var, [var])
+        elif segment in ('this', 'that'):
+            address = segment if index == 0 else \
+                '{} + {}'.format(segment, index)
+            return Value('R[{}]'.format(address), [segment, 'M'])
+        elif segment == 'static':
+            return Value('S[{}]'.format(index), ['S'])
+        raise ValueError('Unknown segment {}.'.format(segment))
+
+    def store(self, segment, index, value, indent):
+        """Emits the assignment of a pop command.
+        """
+
+        if segment in ('local', 'argument', 'temp'):
+            target = '{}{}'.format(segment[0], index)
+            writes = [target]
+        elif segment == 'pointer':
+            target = ('this', 'that')[index]
+            writes = [target]
+        elif segment in ('this', 'that'):
+            target = 'R[{}]'.format(segment if index == 0 else
+                                    '{} + {}'.format(segment, index))
+            writes = ['M']
+        elif segment == 'static':
+            target = 'S[{}]'.format(index)
+            writes = ['S']
+        else:
+            raise ValueError('Cannot pop to {}.'.format(segment))
+        self.flush(frozenset(writes), indent)
+        self.emit('{} = {}'.format(target, value.expr), indent)
+
+    def arithmetic(self, op):
+        if op in ('neg', 'not'):
+            x, = self.pop()
+            if op == 'neg':
+                return Value(WRAP.format('-' + x.expr), x.reads)
+            test = None
+            if x.test != x.expr:  # a comparison, so 0 or -1
+                test = 'not {}'.format(x.test)
+            return Value('(~{})'.format(x.expr), x.reads, test)
+
+        x, y = self.pop(2)
+        reads = x.reads | y.reads
+        if op in COMPARISONS:
+            test = '({} {} {})'.format(x.expr, COMPARISONS[op], y.expr)
+            return Value('(-{})'.format(test), reads, test)
+        elif op in BINARY:
+            return Value(BINARY[op].format(x.expr, y.expr), reads)
+        return Value(WRAP.format('{} {} {}'.format(
+            x.expr, '+' if op == 'add' else '-', y.expr)), reads)
+
+    def call(self, name, n_args, indent):
+        args = self.pop(n_args)
+        self.flush(CALL_WRITES, indent)
+        class_name, subroutine = name.split('.', 1)
+        func = python_name(subroutine) if class_name == self.class_name \
+            else "F['{}']".format(name)
+        var = self.new_var()
+        self.emit('{} = {}({})'.format(
+            var, func, ', '.join(x.expr for x in args)), indent)
+        self.stack.append(Value(var))
+
+    def jump(self, index, target, indent):
+        """Emits a jump to a block. Forward jumps just fall through the
+        remaining tests of the dispatch.
+        """
+
+        self.emit('pc = {}'.format(target), indent)
+        if target <= index:
+            self.emit('continue', indent)
+
+    def spill(self, indent):
+        """Moves the values left on the stack at the end of a block into the
+        variables the next block starts with.
+        """
+
+        if self.stack:
+            names = ['b{}'.format(i) for i in range(len(self.stack))]
+            self.emit('{} = {}'.format(
+                ', '.join(names), ', '.join(x.expr for x in self.stack)),
+                indent)
+
+    def translate_block(self, index, indent):
+        self.stack = [Value('b{}'.format(i), ['b{}'.format(i)])
+                      for i in range(self.depth[index])]
+        ends = False
+        for command in self.blocks[index]:
+            parts = command.split()
+            op = parts[0]
+            if op == 'label':
+                continue
+            elif op == 'push':
+                self.stack.append(self.push(parts[1], int(parts[2])))
+            elif op == 'pop':
+                value, = self.pop()
+                self.store(parts[1], int(parts[2]), value, indent)
+            elif op == 'call':
+                self.call(parts[1], int(parts[2]), indent)
+            elif op == 'return':
+                value, = self.pop()
+                self.emit('return {}'.format(value.expr), indent)
+                ends = True
+            elif op == 'goto':
+                self.spill(indent)
+                self.jump(index, self.labels[parts[1]], indent)
+                ends = True
+            elif op == 'if-goto':
+                condition, = self.pop()
+                self.spill(indent)
+                target = self.labels[parts[1]]
+                if target > index:
+                    self.emit('pc = {} if {} else {}'.format(
+                        target, condition.test, index + 1), indent)
+                else:
+                    self.emit('if {}:'.format(condition.test), indent)
+                    self.jump(index, target, indent + 1)
+                    self.emit('pc = {}'.format(index + 1), indent)
+                ends = True
+            else:
+                self.stack.append(self.arithmetic(op))
+        if not ends:
+            self.spill(indent)
+            if index + 1 < len(self.blocks):
+                self.emit('pc = {}'.format(index + 1), indent)
+
+    def translate(self):
+        """Translates the function.
+
+        Returns:
+            list: Lines of Python code
+        """
+
+        body = [x for block in self.blocks for x in block]
+        n_args = 1 + max([int(x.split()[2]) for x in body
+                          if x.split()[1:2] == ['argument']] + [-1])
+        params = ['a{}'.format(i) for i in range(n_args)] + ['*_']
+        self.emit('def {}({}):'.format(
+            python_name(self.name.split('.', 1)[1]), ', '.join(params)), 0)
+
+        # the VM zeroes locals; the rest are zeroed in case they are read
+        # before being written
+        names = ['l{}'.format(i) for i in range(self.n_locals)]
+        names += sorted({'{}{}'.format(x.split()[1][0], x.split()[2])
+                         for x in body if x.startswith('push temp')})
+        names += sorted({('this', 'that')[int(x.split()[2])] for x in body
+                         if x.startswith('push pointer')})
+        if names:
+            self.emit('{} = 0'.format(' = '.join(names)), 1)
+
+        targets = set(self.labels.values())
+        loops = any(self.labels[x.split()[1]] <= i
+                    for i, block in enumerate(self.blocks)
+                    for x in block if x.startswith(('goto', 'if-goto')))
+        indent = 1
+        for index in sorted(self.depth):
+            if index == 0 and 0 not in targets:
+                self.translate_block(0, indent)
+                if loops:
+                    self.emit('while True:', indent)
+                    indent += 1
+                continue
+            if index == 0:
+                self.emit('pc = 0', indent)
+                if loops:
+                    self.emit('while True:', indent)
+                    indent += 1
+            self.emit('if pc == {}:'.format(index), indent)
+            self.translate_block(index, indent + 1)
+        return self.lines
+
+
+def python_name(subroutine):
+    """Returns the name of the Python function of a subroutine of the class
+    being translated.
+
+    Args:
+        subroutine (str): Jack subroutine name, without the class
+
+    Returns:
+        str: A name that can't clash with Python keywords or the module's
+         globals.
+    """
+
+    return 'jack_' + subroutine
+
+
+def translate(commands, class_name):
+    """Translates the VM code of a class into a Python module for
+    jackRuntime.
+
+    Args:
+        commands (list): VM commands of the class
+        class_name (str): Name of the class
+
+    Returns:
+        str: Source code of the module
+    """
+
+    n_statics = 1 + max([int(x.split()[2]) for x in commands
+                         if x.split()[1:2] == ['static']] + [-1])
+    lines = [HEADER + ' from class {}.'.format(class_name),
+             'import jackRuntime as rt', '',
+             'R = rt.RAM', 'F = rt.FUNCTIONS']
+    if n_statics:
+        lines.append('S = rt.statics({})'.format(n_statics))
+
+    names = []
+    for function in split_functions(commands):
+        if not function[0].startswith('function'):
+            continue
+        lines += ['', '']
+        lines += FunctionTranslator(function, class_name,
+                                    n_statics).translate()
+        names.append(function[0].split()[1])
+
+    lines += ['', '', 'rt.register({']
+    lines += ["    '{}': {},".format(name, python_name(name.split('.', 1)[1]))
+              for name in names]
+    lines.append('})')
+    return '\n'.join(lines) + '\n'
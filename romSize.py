@@ -0,0 +1,155 @@
+import json
+from cfg import split_functions
+
+ROM_SIZE = 32768
+
+# Hack instructions emitted for each VM command by a straightforward VM
+# translator. "function local" is charged per local the function
+# initializes, "bootstrap" once per program and "os" covers the OS classes
+# linked with it.
+DEFAULT_COSTS = {
+    'push constant': 7,
+    'push local': 10, 'push argument': 10, 'push this': 10, 'push that': 10,
+    'push temp': 7, 'push pointer': 7, 'push static': 7,
+    'pop local': 12, 'pop argument': 12, 'pop this': 12, 'pop that': 12,
+    'pop temp': 5, 'pop pointer': 5, 'pop static': 5,
+    'add': 5, 'sub': 5, 'and': 5, 'or': 5,
+    'neg': 3, 'not': 3,
+    'eq': 13, 'gt': 13, 'lt': 13,
+    'label': 0, 'goto': 2, 'if-goto': 5,
+    'call': 44, 'function': 0, 'function local': 4, 'return': 50,
+    'bootstrap': 48, 'os': 0
+}
+
+
+def load_costs(path=None):
+    """Returns the expansion cost table, updated from a JSON file.
+
+    Args:
+        path (str, optional): JSON object mapping cost keys (e.g.
+         "push local", "call") to Hack instruction counts.
+
+    Returns:
+        dict: The cost table
+    """
+
+    costs = dict(DEFAULT_COSTS)
+    if path is not None:
+        with open(path, 'r') as f:
+            costs.update(json.load(f))
+    return costs
+
+
+def command_cost(command, costs):
+    """Estimates the Hack instructions a VM command expands to.
+
+    Args:
+        command (str): A VM command
+        costs (dict): The cost table
+
+    Returns:
+        int: Estimated number of Hack instructions
+    """
+
+    parts = command.split()
+    if parts[0] in ('push', 'pop'):
+        return costs[parts[0] + ' ' + parts[1]]
+    elif parts[0] == 'function':
+        return costs['function'] + int(parts[2]) * costs['function local']
+    return costs[parts[0]]
+
+
+def string_literals(commands):
+    """Finds the string literals built by a function: a "String.new" call
+    followed by "String.appendChar" calls on constants.
+
+    Args:
+        commands (list): VM commands of a function
+
+    Yields:
+        tuple: (start, end, text) of each literal's commands
+    """
+
+    i = 0
+    while i < len(commands):
+        if commands[i] == 'call String.new 1' and i > 0 and \
+           commands[i - 1].startswith('push constant'):
+            start = i - 1
+            chars = []
+            i += 1
+            while (i + 1 < len(commands)
+                   and commands[i].startswith('push constant')
+                   and commands[i + 1] == 'call String.appendChar 2'):
+                chars.append(chr(int(commands[i].split()[2])))
+                i += 2
+            yield start, i, ''.join(chars)
+        else:
+            i += 1
+
+
+class SizeReport:
+    """Estimated ROM footprint of a program.
+    """
+
+    def __init__(self, commands, costs=None):
+        """Estimates the size of every function, class and string literal.
+
+        Args:
+            commands (list): VM commands of every class of the program
+            costs (dict, optional): The cost table. Defaults to
+             DEFAULT_COSTS.
+        """
+
+        costs = costs or DEFAULT_COSTS
+        self.overhead = costs['bootstrap'] + costs['os']
+        self.functions = {}
+        self.classes = {}
+        self.strings = []
+        self.by_command = {}
+
+        for function in split_functions(commands):
+            if not function[0].startswith('function'):
+                continue
+            name = function[0].split()[1]
+            sizes = [command_cost(x, costs) for x in function]
+            for command, size in zip(function, sizes):
+                op = ' '.join(command.split()[:2]) \
+                    if command.startswith(('push', 'pop')) \
+                    else command.split()[0]
+                self.by_command[op] = self.by_command.get(op, 0) + size
+
+            self.functions[name] = sum(sizes)
+            class_name = name.split('.')[0]
+            self.classes[class_name] = self.classes.get(class_name, 0) + \
+                self.functions[name]
+            for start, end, text in string_literals(function):
+                self.strings.append((sum(sizes[start:end]), name, text))
+
+        self.total = self.overhead + sum(self.functions.values())
+
+    def report(self, top=10):
+        """Returns a report ranking the biggest contributors.
+
+        Args:
+            top (int, optional): How many entries to list per ranking
+
+        Returns:
+            list: Lines of the report
+        """
+
+        lines = ['estimated ROM size: {} of {} instructions'
+                 .format(self.total, ROM_SIZE)]
+
+        def rank(title, items):
+            lines.append(title)
+            for size, name in sorted(items, reverse=True)[:top]:
+                lines.append('  {:6d} {:5.1f}%  {}'.format(
+                    size, 100.0 * size / max(self.total, 1), name))
+
+        rank('classes:', [(v, k) for k, v in self.classes.items()])
+        rank('functions:', [(v, k) for k, v in self.functions.items()])
+        rank('string literals:',
+             [(size, '{} "{}"'.format(name, text))
+              for size, name, text in self.strings])
+        rank('commands:', [(v, k) for k, v in self.by_command.items()])
+        return lines
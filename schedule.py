@@ -0,0 +1,172 @@
+from cfg import split_functions
+from stackAnalysis import FunctionInfo
+
+COMMUTATIVE = ('add', 'and', 'or', 'eq')
+# a < b is b > a
+MIRRORED = {'lt': 'gt', 'gt': 'lt'}
+BINARY = ('add', 'sub', 'and', 'or', 'eq', 'lt', 'gt')
+# What a call may read and write: memory, statics, temp, pointer 1, and
+# whatever else it does (output, ...), which orders calls among themselves.
+CALL_EFFECTS = frozenset(('M', 'S', 'T', 'P1', 'IO'))
+
+
+class Expression:
+    """An expression of a function: the range of commands computing it and
+    what those commands read and write.
+
+    State is named "M" (this/that), "S" (statics), "T" (temp), "P0" and
+    "P1" (pointers) and "IO" (any other effect of a call).
+    """
+
+    def __init__(self, start, end, need, reads=(), writes=()):
+        """Creates a new Expression.
+
+        Args:
+            start (int): Index of the first command
+            end (int): Index after the last command
+            need (int): Stack slots needed to evaluate it
+            reads (iterable, optional): State read
+            writes (iterable, optional): State written
+        """
+
+        self.start = start
+        self.end = end
+        self.need = need
+        self.reads = frozenset(reads)
+        self.writes = frozenset(writes)
+
+    def independent(self, other):
+        """Can the two expressions be evaluated in either order?
+
+        Args:
+            other (Expression): Another expression
+
+        Returns:
+            bool: True if neither writes what the other reads or writes
+        """
+
+        return not (self.writes & (other.reads | other.writes) or
+                    other.writes & self.reads)
+
+
+def push_reads(command):
+    """Returns the state a push reads. Locals and arguments are left out, as
+    expressions never write them.
+
+    Args:
+        command (str): A push command
+
+    Returns:
+        tuple: Names of the state read
+    """
+
+    _, segment, index = command.split()
+    if segment in ('this', 'that'):
+        return ('M', 'P0' if segment == 'this' else 'P1')
+    elif segment == 'pointer':
+        return ('P' + index,)
+    elif segment == 'static':
+        return ('S',)
+    elif segment == 'temp':
+        return ('T',)
+    return ()
+
+
+def schedule_function(commands):
+    """Reorders the operands of commutative operators so that the one
+    needing more stack is evaluated first (Sethi-Ullman labelling).
+
+    Operands are only swapped when neither writes anything the other reads
+    or writes, so calls keep their order and never move past loads of the
+    memory they may change. "pop pointer 1; push that i" counts as a load
+    writing pointer 1; any other pop ends the expressions it interrupts.
+
+    Args:
+        commands (list): VM commands of a single function
+
+    Returns:
+        tuple: The rewritten commands and the number of operands swapped
+    """
+
+    commands = list(commands)
+    stack = []
+    swaps = 0
+    i = 0
+    while i < len(commands):
+        command = commands[i]
+        parts = command.split()
+        op = parts[0]
+
+        if op == 'push':
+            stack.append(Expression(i, i + 1, 1, push_reads(command)))
+        elif (command == 'pop pointer 1' and stack and i + 1 < len(commands)
+                and commands[i + 1].startswith('push that')):
+            address = stack.pop()
+            stack.append(Expression(address.start, i + 2, address.need,
+                                    address.reads | {'M'},
+                                    address.writes | {'P1'}))
+            i += 1
+        elif op in BINARY and len(stack) >= 2:
+            right = stack.pop()
+            left = stack.pop()
+            if ((op in COMMUTATIVE or op in MIRRORED)
+                    and right.need > left.need
+                    and left.independent(right)):
+                commands[left.start:i] = (commands[right.start:right.end] +
+                                          commands[left.start:left.end])
+                commands[i] = MIRRORED.get(op, op)
+                left, right = right, left
+                swaps += 1
+            stack.append(Expression(
+                min(left.start, right.start), i + 1,
+                max(left.need, right.need + 1),
+                left.reads | right.reads, left.writes | right.writes))
+        elif op in ('neg', 'not') and stack:
+            operand = stack.pop()
+            stack.append(Expression(operand.start, i + 1, operand.need,
+                                    operand.reads, operand.writes))
+        elif op == 'call' and len(stack) >= int(parts[2]):
+            n_args = int(parts[2])
+            args = stack[len(stack) - n_args:]
+            del stack[len(stack) - n_args:]
+            need = max([k + x.need for k, x in enumerate(args)] + [1])
+            reads = CALL_EFFECTS.union(*(x.reads for x in args))
+            writes = CALL_EFFECTS.union(*(x.writes for x in args))
+            stack.append(Expression(args[0].start if args else i, i + 1,
+                                    need, reads, writes))
+        else:
+            # statements, jumps and anything the stack can't explain
+            stack = []
+        i += 1
+    return commands, swaps
+
+
+def optimize(commands, report=None):
+    """Schedules the expressions of every function of a class.
+
+    Args:
+        commands (list): VM commands of a class
+        report (list, optional): Receives a line for each function whose
+         operand stack got shallower
+
+    Returns:
+        list: The rewritten VM commands
+    """
+
+    ret = []
+    for function in split_functions(commands):
+        if not function[0].startswith('function'):
+            ret.extend(function)
+            continue
+        new_function, swaps = schedule_function(function)
+        ret.extend(new_function)
+
+        if report is None or not swaps:
+            continue
+        before = FunctionInfo(function).max_depth
+        after = FunctionInfo(new_function).max_depth
+        if after < before:
+            report.append('{}: operand stack depth {} -> {} ({} operands '
+                          'reordered)'.format(function[0].split()[1],
+                                              before, after, swaps))
+    return ret
@@ -0,0 +1,209 @@
+from cfg import split_functions
+
+# Words pushed by "call": return address, LCL, ARG, THIS and THAT.
+FRAME_SIZE = 5
+# The Hack stack runs from RAM[256] up to the heap at RAM[2048].
+STACK_SIZE = 2048 - 256
+# Frames of the bootstrap "call Sys.init 0" and of Sys.init calling the
+# entry point.
+BOOTSTRAP_DEPTH = 2 * FRAME_SIZE
+
+
+def stack_effect(command):
+    """Returns how many values a VM command pops and pushes.
+
+    Args:
+        command (str): A VM command
+
+    Returns:
+        tuple: (popped, pushed)
+    """
+
+    parts = command.split()
+    op = parts[0]
+    if op == 'push':
+        return 0, 1
+    elif op in ('pop', 'if-goto', 'return'):
+        return 1, 0
+    elif op in ('add', 'sub', 'and', 'or', 'eq', 'lt', 'gt'):
+        return 2, 1
+    elif op in ('neg', 'not'):
+        return 1, 1
+    elif op == 'call':
+        return int(parts[2]), 1
+    elif op in ('label', 'goto', 'function'):
+        return 0, 0
+    raise ValueError('{} is not a VM command.'.format(command))
+
+
+class FunctionInfo:
+    """Stack usage of a single VM function.
+    """
+
+    def __init__(self, commands):
+        """Computes the operand stack depth at every command of a function.
+
+        Args:
+            commands (list): VM commands, starting with "function"
+
+        Raises:
+            ValueError: If two paths reach a command with different depths
+             or a path pops from an empty stack.
+        """
+
+        _, self.name, n_locals = commands[0].split()
+        self.n_locals = int(n_locals)
+        self.max_depth = 0
+        self.calls = []  # (callee, depth with the arguments pushed)
+
+        labels = {x.split()[1]: i for i, x in enumerate(commands)
+                  if x.startswith('label')}
+        depth_at = [None] * len(commands)
+        work = [(1, 0)]
+        while work:
+            pc, depth = work.pop()
+            while pc < len(commands):
+                if depth_at[pc] is not None:
+                    if depth_at[pc] != depth:
+                        raise ValueError('{}: inconsistent stack depth at {}'
+                                         .format(self.name, commands[pc]))
+                    break
+                depth_at[pc] = depth
+
+                command = commands[pc]
+                popped, pushed = stack_effect(command)
+                if popped > depth:
+                    raise ValueError('{}: stack underflow at {}'
+                                     .format(self.name, command))
+                if command.startswith('call'):
+                    self.calls.append((command.split()[1], depth))
+                depth += pushed - popped
+                self.max_depth = max(self.max_depth, depth)
+
+                if command.startswith(('goto', 'if-goto')):
+                    work.append((labels[command.split()[1]], depth))
+                if command.startswith(('goto', 'return')):
+                    break
+                pc += 1
+
+
+class StackAnalysis:
+    """Worst-case stack usage of a whole program, over its call graph.
+    """
+
+    def __init__(self, commands, external_depth=0):
+        """Analyses the VM code of a program.
+
+        Args:
+            commands (list): VM commands of every class of the program
+            external_depth (int, optional): Words charged for each call to a
+             function outside the program (e.g. the OS). Defaults to 0.
+        """
+
+        self.external_depth = external_depth
+        self.functions = {}
+        for function in split_functions(commands):
+            if function[0].startswith('function'):
+                info = FunctionInfo(function)
+                self.functions[info.name] = info
+        self.externals = sorted({callee for info in self.functions.values()
+                                 for callee, _ in info.calls
+                                 if callee not in self.functions})
+        self._bounds = {}
+
+    def bound(self, name):
+        """Returns the worst-case number of words a function needs above its
+        arguments: its locals, its operand stack and everything it calls.
+
+        Args:
+            name (str): Function name
+
+        Returns:
+            int: The bound, or None if the function can recurse
+        """
+
+        if name not in self.functions:
+            return self.external_depth
+        if name in self._bounds:
+            return self._bounds[name]
+
+        self._bounds[name] = None  # a call back to here is recursion
+        info = self.functions[name]
+        worst = info.max_depth
+        for callee, depth in info.calls:
+            callee_bound = self.bound(callee)
+            if callee_bound is None:
+                return None
+            worst = max(worst, depth + FRAME_SIZE + callee_bound)
+        self._bounds[name] = info.n_locals + worst
+        return self._bounds[name]
+
+    def entry_points(self):
+        """Returns the functions no other function of the program calls.
+        """
+
+        called = {callee for info in self.functions.values()
+                  for callee, _ in info.calls}
+        return [name for name in self.functions if name not in called]
+
+    def entry_bound(self, name):
+        """Returns the worst-case stack size when the program starts at the
+        given function.
+
+        Args:
+            name (str): Function name
+
+        Returns:
+            int: Words of stack, or None if unbounded
+        """
+
+        bound = self.bound(name)
+        if bound is not None:
+            return BOOTSTRAP_DEPTH + bound
+        return None
+
+    def report(self):
+        """Returns a report of the stack usage.
+
+        Returns:
+            list: Lines of the report
+        """
+
+        lines = []
+        for name, info in self.functions.items():
+            bound = self.bound(name)
+            lines.append('{}: operand depth {}, {} locals, worst case {}'
+                         .format(name, info.max_depth, info.n_locals,
+                                 'unbounded (recursion)' if bound is None
+                                 else '{} words'.format(bound)))
+        for name in self.entry_points():
+            bound = self.entry_bound(name)
+            lines.append('entry {}: {}'.format(
+                name, 'unbounded (recursion)' if bound is None
+                else '{} of {} words'.format(bound, STACK_SIZE)))
+        if self.externals:
+            lines.append('external calls charged {} words: {}'.format(
+                self.external_depth, ', '.join(self.externals)))
+        return lines
+
+    def check(self, budget):
+        """Returns a message for each entry point whose worst-case stack
+        size is unbounded or over the budget.
+
+        Args:
+            budget (int): Stack budget in words
+
+        Returns:
+            list: The messages (empty if every entry point fits)
+        """
+
+        messages = []
+        for name in self.entry_points():
+            bound = self.entry_bound(name)
+            if bound is None:
+                messages.append('{} reaches a recursive call; its stack '
+                                'usage is unbounded.'.format(name))
+            elif bound > budget:
+                messages.append('{} may use {} words of stack; the budget '
+                                'is {}.'.format(name, bound, budget))
+        return messages
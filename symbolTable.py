@@ -76,6 +76,22 @@ class SymbolTable(dict):
     def var_count(self, kind):
         return self._count[kind]
 
+    def names(self, kind):
+        """Returns the names of the variables of a kind, in index order.
+        
+        Args:
+            kind (str): STATIC, ARG, FIELD or VAR
+        
+        Returns:
+            list: The variable names
+        """
+
+        scope = self._subroutine_scope if kind in ('ARG', 'VAR') else (
+            self._static_scope if kind == 'STATIC' else self._field_scope)
+        found = [(i, name) for name, (_type, _kind, i) in scope.items()
+                 if _kind == kind]
+        return [name for i, name in sorted(found)]
+
 
 if __name__ == '__main__':
     d = SymbolTable()
@@ -20,6 +20,22 @@ class Tokenizer:
         
         self.total_tokens = len(self.tokens)
     
+    @classmethod
+    def from_tokens(cls, tokens):
+        """Creates a Tokenizer over already tokenized code.
+        
+        Args:
+            tokens (list): Jack tokens
+        
+        Returns:
+            Tokenizer: The tokenizer, at the first token
+        """
+
+        tk = cls([])
+        tk.tokens = list(tokens)
+        tk.total_tokens = len(tk.tokens)
+        return tk
+
     def advance(self):
         """Advance the token pointer by one. Throws error if no more tokens."""
 
@@ -129,19 +145,35 @@ class Tokenizer:
         lines = []
         comment_on = False
         for line in raw_code:
-            line = line.strip()
-            if line.startswith('/*') and (not line.endswith('*/')):
-                comment_on = True
-            
-            if not comment_on:
+            line, comment_on = Tokenizer.clean_line(line, comment_on)
+            if line:
                 lines.append(line)
+        return lines
+
+    @staticmethod
+    def clean_line(line, comment_on):
+        """Removes comments from a single line of raw code.
+        
+        Args:
+            line (str): A line from the Jack file
+            comment_on (bool): Is the line inside a multi-line comment?
+        
+        Returns:
+            tuple: The clean code (empty if there is none) and whether the \
+             next line is inside a multi-line comment.
+        """
 
-            if line.startswith('*/') or line.endswith('*/'):
-                comment_on = False
+        line = line.strip()
+        if line.startswith('/*') and (not line.endswith('*/')):
+            comment_on = True
+        
+        clean = ''
+        if not comment_on and Tokenizer.is_valid(line):
+            clean = line.split('//')[0].strip()
 
-        lines = [line.split('//')[0].strip() for line in lines 
-                 if Tokenizer.is_valid(line)]
-        return lines
+        if line.startswith('*/') or line.endswith('*/'):
+            comment_on = False
+        return clean, comment_on
     
     @staticmethod
     def is_valid(line):